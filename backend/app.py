@@ -1,18 +1,45 @@
 """
 Flask API server for RAG chatbot using Google Gemini.
 Enhanced with vector embeddings for semantic search.
+
+Importing this module only defines the app. create_app() prepares the
+database and warms up in the background (index snapshot, Gemini SDK):
+/health/live answers at once, /health/ready once warm-up has finished.
+    gunicorn -w 4 -b 0.0.0.0:5000 "app:create_app()"
+Serving the module-level app directly (app:app, flask run) also works: it
+calls create_app() itself on its first request.
 """
 
 import os
 import json
+import time
+import atexit
+import signal
+import hashlib
 import sqlite3
+import threading
 import datetime
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context, g
 from flask_cors import CORS
-import google.generativeai as genai
 from dotenv import load_dotenv
-from sklearn.metrics.pairwise import cosine_similarity
-from werkzeug.security import generate_password_hash, check_password_hash
+from vector_index import VectorIndex
+from database import Database, DB_NAME
+from password_hasher import PasswordHasher, HasherBusy
+from upstream_limiter import UpstreamLimiter, UpstreamBusy, CHAT
+from ivf_index import IVFIndex, ivf_path_for
+from quantized_index import QuantizedIndex, KINDS as QUANTIZATION_KINDS
+from doc_filters import RetrievalFilter
+import embedding_store
+from cache import LRUCache, SemanticCache, SingleFlight, AsyncSingleFlight, normalize_query
+from prompt_builder import build_prompt, response_usage, cached_usage, TokenMeter
+import metrics
+from metrics import span, profiled
+from session_store import create_session_store
+from embedding_pipeline import GeminiEmbeddingClient, sync_embeddings, document_text, content_hash, EMBEDDING_MODEL
+from bm25_index import BM25Index, bm25_path_for, corpus_fingerprint, reciprocal_rank_fusion
+from index_snapshot import IndexSnapshot, FileWatcher, align_embeddings
+from kb_store import read_records
+from lazy_import import LazyObject
 
 # Load environment variables
 load_dotenv()
@@ -20,173 +47,380 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
-# Database Setup
-DB_NAME = "users.db"
-
-def init_db():
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                role TEXT DEFAULT 'client',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        # Simple migration for existing DB
-        try:
-            cursor.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'client'")
-        except sqlite3.OperationalError:
-            pass # Column already exists
-        conn.commit()
-    print("DONE: Database initialized")
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method, route=route, status=response.status_code
+        )
+    return response
+
+# Database Setup (the schema is created by create_app)
+db = Database(DB_NAME)
+
+def observe_hash_timing(waited, took):
+    metrics.STAGE_SECONDS.observe(waited, stage="password_hash_queue")
+    metrics.STAGE_SECONDS.observe(took, stage="password_hash_compute")
+
+# Password hashing runs in a bounded process pool (HASH_WORKERS, HASH_MAX_QUEUE, HASH_METHOD)
+password_hasher = PasswordHasher(observe=observe_hash_timing)
+HASHER_BUSY_RETRY_AFTER = "1"
 
-# Initialize DB on startup
-init_db()
+def hasher_busy_response():
+    """Fast 503 when the password hashing queue is full."""
+    response = jsonify({"error": "Server is busy, please try again shortly"})
+    response.headers['Retry-After'] = HASHER_BUSY_RETRY_AFTER
+    return response, 503
 
 # Configure Gemini API
 api_key = os.getenv("GEMINI_API_KEY")
 if not api_key:
     print("WARNING: GEMINI_API_KEY not found in environment variables!")
-genai.configure(api_key=api_key)
 
-# Load knowledge base
-knowledge_base_path = os.path.join(os.path.dirname(__file__), "knowledge_base.json")
-embeddings_path = os.path.join(os.path.dirname(__file__), "embeddings.json")
-knowledge_base = []
-document_embeddings = []
-
-def load_knowledge_base():
-    """Load knowledge base from JSON file."""
-    global knowledge_base
-    try:
-        with open(knowledge_base_path, 'r', encoding='utf-8') as f:
-            knowledge_base = json.load(f)
-        print(f"DONE: Loaded {len(knowledge_base)} documents from knowledge base")
-    except FileNotFoundError:
-        print("WARNING: knowledge_base.json not found. Run ingest_data.py first!")
+def load_genai():
+    import google.generativeai as genai_module
+    genai_module.configure(api_key=api_key)
+    return genai_module
 
-def load_embeddings():
-    """Load pre-computed embeddings if available."""
-    global document_embeddings
-    try:
-        with open(embeddings_path, 'r', encoding='utf-8') as f:
-            document_embeddings = json.load(f)
-        print(f"DONE: Loaded {len(document_embeddings)} document embeddings")
-        return True
-    except FileNotFoundError:
-        print("WARNING: Embeddings not found. Will generate on first query...")
-        return False
+# google.generativeai takes about a second to import; it is loaded during warm-up or on first use
+genai = LazyObject(load_genai, "google.generativeai")
+
+# Rate and concurrency limits for Gemini shared by all workers (UPSTREAM_* settings)
+gemini_limiter = UpstreamLimiter()
 
-def get_embedding(text):
-    """Get embedding for a piece of text using Gemini's embedding model."""
+UPSTREAM_BUSY_MESSAGE = "The assistant is busy, please try again shortly"
+
+def upstream_busy_response(error):
+    """Fast 503 when Gemini calls are at their limit or Gemini keeps answering 429."""
+    response = jsonify({"error": UPSTREAM_BUSY_MESSAGE})
+    response.headers['Retry-After'] = error.retry_after_header
+    return response, 503
+
+# Load knowledge base
+knowledge_base_path = os.path.join(os.path.dirname(__file__), "knowledge_base.jsonl")
+legacy_knowledge_base_path = os.path.join(os.path.dirname(__file__), "knowledge_base.json")
+embeddings_path = os.path.join(os.path.dirname(__file__), "embeddings.npy")
+legacy_embeddings_path = os.path.join(os.path.dirname(__file__), "embeddings.json")
+embedding_client = GeminiEmbeddingClient(EMBEDDING_MODEL, genai=genai, limiter=gemini_limiter)
+
+# Everything retrieval reads lives in one immutable snapshot; reloads swap it whole
+snapshot = IndexSnapshot([], BM25Index.build([]), VectorIndex.empty())
+reload_lock = threading.Lock()  # snapshot builds run one at a time, newest files win
+embed_lock = threading.Lock()  # one embedding sync at a time
+last_background_embed = float("-inf")
+BACKGROUND_EMBED_INTERVAL = 60  # seconds between automatic embedding attempts
+
+# Reload when ingest_data.py rewrites the knowledge base or embeddings (0 disables polling)
+RELOAD_POLL_SECONDS = float(os.getenv("RELOAD_POLL_SECONDS", "5"))
+index_watcher = FileWatcher(
+    [knowledge_base_path, legacy_knowledge_base_path, embedding_store.meta_path_for(embeddings_path)],
+    lambda: reload_index("files changed"),
+    interval=RELOAD_POLL_SECONDS,
+)
+# Search backend: "exact" scores every document, "ivf" uses the approximate IVF index,
+# "int8"/"binary" scan compressed codes and re-rank a shortlist exactly
+SEARCH_INDEX = os.getenv("SEARCH_INDEX", "exact").lower()
+QUANTIZED_RERANK = int(os.getenv("QUANTIZED_RERANK", "0")) or None  # shortlist = top_k x this
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0")) or None  # default: sqrt(document count)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))  # lists scanned per query; higher = better recall
+
+# Retrieval mode: "vector" ranks by embedding similarity, "hybrid" fuses it with BM25
+SEARCH_MODE = os.getenv("SEARCH_MODE", "vector").lower()
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "4"))  # per-ranker candidates = top_k x this
+
+# Retrieval: chunks fetched per query (prompt_builder.py decides how many fit the prompt)
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+
+# Caches: query embeddings keyed by normalized text, answers keyed by
+# (normalized question, retrieved chunk ids, recent history). A size of 0 disables a cache.
+query_embedding_cache = LRUCache(
+    max_entries=int(os.getenv("QUERY_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("QUERY_CACHE_TTL", "86400")),
+)
+answer_cache = LRUCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+)
+# History-free questions also reuse the answer of a paraphrase (query embedding within
+# the cosine threshold) whose top SEMANTIC_CACHE_SOURCES retrieved pages were the same
+SEMANTIC_CACHE_SOURCES = int(os.getenv("SEMANTIC_CACHE_SOURCES", "2"))
+semantic_cache = SemanticCache(
+    max_entries=int(os.getenv("SEMANTIC_CACHE_SIZE", "256")),
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+)
+
+# Identical requests already in flight share one upstream call (same keys as the caches).
+# The async pair is used by asgi.py.
+embed_flight = SingleFlight()
+generate_flight = SingleFlight()
+async_embed_flight = AsyncSingleFlight()
+async_generate_flight = AsyncSingleFlight()
+
+def coalescing_stats():
+    """Single-flight counters, threaded and async paths combined."""
+    stats = {}
+    for name, flights in (("embeddings", (embed_flight, async_embed_flight)),
+                          ("answers", (generate_flight, async_generate_flight))):
+        parts = [flight.stats() for flight in flights]
+        stats[name] = {field: sum(p[field] for p in parts) for field in ("calls", "shared", "in_flight")}
+    return stats
+
+def read_knowledge_base():
+    """Knowledge-base records from knowledge_base.jsonl (or a legacy knowledge_base.json)."""
+    for path in (knowledge_base_path, legacy_knowledge_base_path):
+        if os.path.exists(path):
+            docs = read_records(path)
+            print(f"DONE: Loaded {len(docs)} documents from {os.path.basename(path)}")
+            return docs
+    print("WARNING: knowledge_base.jsonl not found. Run ingest_data.py first!")
+    return []
+
+def build_keyword_index(docs):
+    """Load the BM25 index written by ingest_data.py, rebuilding it if it is missing or stale."""
+    path = bm25_path_for(knowledge_base_path)
+    source = corpus_fingerprint(document_text(doc) for doc in docs)
+    index = None
+    if os.path.exists(path):
+        index = BM25Index.load(path, expected_source=source)
+    if index is None:
+        index = BM25Index.build(document_text(doc) for doc in docs)
+        if docs:
+            try:
+                index.save(path)
+            except Exception as e:
+                print(f"Error saving keyword index: {e}")
+    return index
+
+def read_embeddings(docs):
+    """Load pre-computed embeddings, aligned to docs by content hash."""
     try:
-        result = genai.embed_content(
-            model="models/gemini-embedding-001",
-            content=text,
-            task_type="retrieval_document"
-        )
-        return result['embedding']
-    except Exception as e:
-        print(f"Error getting embedding: {e}")
+        if not embedding_store.exists(embeddings_path) and os.path.exists(legacy_embeddings_path):
+            print("Converting embeddings.json to the binary embedding store...")
+            embedding_store.convert_json(legacy_embeddings_path, embeddings_path)
+        vectors, ids, meta = embedding_store.load_embeddings(embeddings_path)
+    except FileNotFoundError:
+        print("WARNING: Embeddings not found. Will generate them in the background on first query...")
+        return VectorIndex.empty()
+    if meta.get("model") and meta["model"] != EMBEDDING_MODEL:
+        print(f"WARNING: Embeddings were built with {meta['model']}, queries use {EMBEDDING_MODEL}")
+    doc_hashes = [content_hash(document_text(doc)) for doc in docs]
+    vectors, ids = align_embeddings(vectors, ids, meta.get("hashes"), doc_hashes)
+    if len(ids) < len(docs):
+        print(f"WARNING: {len(docs) - len(ids)} documents have no embedding yet")
+    index = VectorIndex(vectors, ids, normalized=True)
+    print(f"DONE: Loaded {len(index)} document embeddings")
+    return index
+
+def build_ann_index(vectors):
+    """Build the SEARCH_INDEX searcher: quantized codes, or the IVF index (loaded or built and saved)."""
+    if not vectors:
+        return None
+    if SEARCH_INDEX in QUANTIZATION_KINDS:
+        codes = QuantizedIndex(vectors, SEARCH_INDEX, rerank=QUANTIZED_RERANK)
+        print(f"DONE: {codes.kind} codes ready ({codes.nbytes / 1e6:.1f} MB, "
+              f"{codes.nbytes / len(codes):.0f} bytes/document, re-rank x{codes.rerank})")
+        return codes
+    if SEARCH_INDEX != "ivf":
+        if SEARCH_INDEX != "exact":
+            print(f"WARNING: Unknown SEARCH_INDEX '{SEARCH_INDEX}', using exact search")
         return None
 
-def generate_all_embeddings():
-    """Generate embeddings for all documents in knowledge base."""
-    global document_embeddings
-    document_embeddings = []
-    
-    print("🔄 Generating embeddings for all documents...")
-    for i, doc in enumerate(knowledge_base):
-        text = f"{doc['title']}: {doc['content']}"
-        embedding = get_embedding(text)
-        if embedding:
-            document_embeddings.append({
-                'index': i,
-                'embedding': embedding
-            })
-        print(f"  Processed {i+1}/{len(knowledge_base)}")
-    
-    # Save embeddings for future use
+    path = ivf_path_for(embeddings_path)
+    ann_index = None
+    if os.path.exists(path):
+        ann_index = IVFIndex.load(path, vectors, nprobe=IVF_NPROBE)
+    if ann_index is None:
+        ann_index = IVFIndex.build(vectors, nlist=IVF_NLIST, nprobe=IVF_NPROBE)
+        try:
+            ann_index.save(path)
+        except Exception as e:
+            print(f"Error saving IVF index: {e}")
+    print(f"DONE: IVF index ready ({ann_index.nlist} lists, nprobe={ann_index.nprobe})")
+    return ann_index
+
+def load_snapshot():
+    """Build a complete IndexSnapshot from the files on disk."""
+    docs = read_knowledge_base()
+    vectors = read_embeddings(docs)
+    return IndexSnapshot(docs, build_keyword_index(docs), vectors, build_ann_index(vectors))
+
+def reload_index(reason="manual"):
+    """Build a fresh snapshot and swap it in. Requests keep using the old one until then."""
+    global snapshot
+    with reload_lock:
+        index_watcher.mark_seen()
+        new_snapshot = load_snapshot()
+        snapshot = new_snapshot
+        # Answers may cite content that just changed
+        answer_cache.clear()
+        semantic_cache.clear()
+    print(f"DONE: Index snapshot v{new_snapshot.version} live ({reason}): "
+          f"{len(new_snapshot.knowledge_base)} documents, {len(new_snapshot.vectors)} embeddings")
+    return new_snapshot
+
+def reload_in_background(reason):
+    threading.Thread(target=reload_index, args=(reason,), name="index-reload", daemon=True).start()
+
+def generate_all_embeddings(full=False, blocking=True):
+    """Embed new or changed knowledge-base documents and swap in the new index.
+
+    Unchanged documents keep their stored embedding; full=True re-embeds everything.
+    Only one run at a time; with blocking=False returns None if one is already running.
+    Also returns None if syncing failed (the error is printed).
+    """
+    if not embed_lock.acquire(blocking=blocking):
+        return None
     try:
-        with open(embeddings_path, 'w', encoding='utf-8') as f:
-            json.dump(document_embeddings, f)
-        print(f"DONE: Saved {len(document_embeddings)} embeddings")
-    except Exception as e:
-        print(f"Error saving embeddings: {e}")
+        print("🔄 Generating embeddings for all documents...")
+        try:
+            stats = sync_embeddings(
+                read_knowledge_base(), embeddings_path, embedding_client, EMBEDDING_MODEL, full=full,
+                progress=lambda done, total: print(f"  Processed {done}/{total}")
+            )
+        except Exception as e:
+            print(f"Error saving embeddings: {e}")
+            return None
+        reload_index("embeddings regenerated")
+        return stats
+    finally:
+        embed_lock.release()
+
+def generate_embeddings_in_background():
+    """Start generate_all_embeddings in a thread, at most once per BACKGROUND_EMBED_INTERVAL."""
+    global last_background_embed
+    now = time.monotonic()
+    if embed_lock.locked() or now - last_background_embed < BACKGROUND_EMBED_INTERVAL:
+        return
+    last_background_embed = now
+    threading.Thread(target=generate_all_embeddings, kwargs={"blocking": False},
+                     name="embed-regenerate", daemon=True).start()
+
+def fetch_query_embedding(query, key):
+    with span("embed_query"):
+        embedding = gemini_limiter.call(lambda: genai.embed_content(
+            model=EMBEDDING_MODEL,
+            content=query,
+            task_type="retrieval_query"
+        ))['embedding']
+    query_embedding_cache.set(key, embedding)
+    return embedding
 
-def semantic_search(query, top_k=3):
-    """Search knowledge base using semantic similarity."""
-    global document_embeddings
-    
-    # Generate embeddings if not available
-    if not document_embeddings:
-        generate_all_embeddings()
+def embed_query(query):
+    """Get the retrieval_query embedding for a user message, using the cache.
+
+    Concurrent misses for the same normalized message share one API call.
+    """
+    key = normalize_query(query)
+    embedding = query_embedding_cache.get(key)
+    if embedding is None:
+        embedding, _ = embed_flight.do(key, lambda: fetch_query_embedding(query, key))
+    return embedding
+
+def semantic_search(query, top_k=3, query_embedding=None, snap=None, filters=None):
+    """Search knowledge base using semantic similarity.
+
+    Pass query_embedding to skip the embedding call (e.g. when it was fetched asynchronously).
+    Everything is read from one snapshot (the live one unless snap is given).
+    filters (a RetrievalFilter) limits the search to the documents it allows;
+    only those rows are scored. UpstreamBusy is raised rather than answered
+    from BM25, so the request fails fast instead of waiting on Gemini again.
+    """
+    snap = snap or snapshot
+    selection = snap.filters.select(filters) if filters is not None else None
+    if selection is not None and len(selection) == 0:
+        return []
     
-    if not document_embeddings:
-        # Fallback to keyword search if embedding fails
-        return keyword_search(query, top_k)
+    if not snap.vectors:
+        # Embed in the background; answer from BM25 meanwhile
+        if snap.knowledge_base:
+            generate_embeddings_in_background()
+        metrics.FALLBACKS.inc(reason="no_embeddings")
+        return keyword_search(query, top_k, snap, filters)
+    if selection is not None and len(selection.rows) == 0:
+        # None of the allowed documents is embedded yet
+        return keyword_search(query, top_k, snap, filters)
+    rows = selection.rows if selection is not None else None
+    excluded_rows = selection.excluded_rows if selection is not None else None
+    allowed = selection.mask if selection is not None else None
     
     try:
         # Get query embedding
-        query_embedding = genai.embed_content(
-            model="models/gemini-embedding-001",
-            content=query,
-            task_type="retrieval_query"
-        )['embedding']
+        if query_embedding is None:
+            query_embedding = embed_query(query)
         
-        # Calculate similarities
-        similarities = []
-        for doc_emb in document_embeddings:
-            similarity = cosine_similarity(
-                [query_embedding], 
-                [doc_emb['embedding']]
-            )[0][0]
-            similarities.append({
-                'index': doc_emb['index'],
-                'similarity': similarity
-            })
-        
-        # Sort by similarity and get top results
-        similarities.sort(key=lambda x: x['similarity'], reverse=True)
-        top_results = similarities[:top_k]
+        # Score documents (all of them, or the probed IVF lists)
+        searcher = snap.searcher
+        if SEARCH_MODE == "hybrid":
+            candidates = top_k * HYBRID_CANDIDATES
+            with span("vector_search"):
+                vector_ranking = [i for i, _ in searcher.search(query_embedding, candidates, rows=rows, excluded_rows=excluded_rows)]
+            with span("keyword_search"):
+                keyword_ranking = [i for i, _ in snap.keyword_index.search(query, candidates, allowed)]
+            top_indices = reciprocal_rank_fusion([vector_ranking, keyword_ranking], top_k)
+        else:
+            with span("vector_search"):
+                top_indices = [i for i, _ in searcher.search(query_embedding, top_k, rows=rows, excluded_rows=excluded_rows)]
         
         # Return corresponding documents
-        return [knowledge_base[r['index']] for r in top_results]
+        return [snap.knowledge_base[index] for index in top_indices]
     
+    except UpstreamBusy:
+        raise
     except Exception as e:
         print(f"Semantic search error: {e}")
-        return keyword_search(query, top_k)
-
-def keyword_search(query, top_k=3):
-    """Fallback keyword-based search in knowledge base."""
-    query_lower = query.lower()
-    results = []
-    
-    for doc in knowledge_base:
-        content = doc['content'].lower()
-        score = 0
-        query_words = query_lower.split()
-        for word in query_words:
-            if len(word) > 3:
-                score += content.count(word)
-        
-        if score > 0:
-            results.append({
-                'doc': doc,
-                'score': score
-            })
-    
-    results.sort(key=lambda x: x['score'], reverse=True)
-    return [r['doc'] for r in results[:top_k]]
-
-# Initialize Gemini model - using latest model
-model = genai.GenerativeModel('gemini-2.5-flash')
-
-# Store conversation history per session (simple in-memory storage)
-conversation_histories = {}
+        metrics.FALLBACKS.inc(reason="error")
+        return keyword_search(query, top_k, snap, filters)
+
+def keyword_search(query, top_k=3, snap=None, filters=None):
+    """Fallback keyword-based search in knowledge base (BM25)."""
+    snap = snap or snapshot
+    selection = snap.filters.select(filters) if filters is not None else None
+    if selection is not None and len(selection) == 0:
+        return []
+    with span("keyword_search"):
+        results = snap.keyword_index.search(query, top_k, selection.mask if selection is not None else None)
+    return [snap.knowledge_base[index] for index, _ in results]
+
+# Initialize Gemini model - using latest model (created on first use, like genai)
+model = LazyObject(lambda: genai.GenerativeModel('gemini-2.5-flash'), "gemini-2.5-flash")
+
+# Conversation history per session (SESSION_STORE=memory or sqlite); built on
+# first use, so importing the app does not open sessions.db
+session_store = LazyObject(create_session_store, "session store")
+
+# Prompt/response token totals across chat requests
+token_meter = TokenMeter()
+
+# Startup state: create_app() runs warm_up() once; chat answers 503 until it is done
+ready = threading.Event()
+startup_lock = threading.Lock()
+app_started = False
+warm_up_seconds = None
+startup_error = None
+STARTING_RETRY_AFTER = "2"
+
+def startup_stats():
+    return {
+        "ready": ready.is_set(),
+        "warm_up_seconds": round(warm_up_seconds, 3) if warm_up_seconds is not None else None,
+        "error": startup_error,
+    }
+
+def starting_response():
+    """Fast 503 for chat requests that arrive before warm-up has finished."""
+    response = jsonify({"error": "Server is starting, please try again shortly"})
+    response.headers['Retry-After'] = STARTING_RETRY_AFTER
+    return response, 503
+
+CHAT_ERROR_MESSAGE = "I apologize, but I'm having trouble processing your request. Please try again or contact us directly."
 
 # System prompt for the chatbot
 SYSTEM_PROMPT = """You are a helpful, friendly AI assistant for Engineers Veedu, a professional construction contractor company based in India.
@@ -234,19 +468,115 @@ def serve_static(filename):
     return send_from_directory(dist_dir, filename)
 
 
+@app.route('/health/live', methods=['GET'])
+def liveness_check():
+    """Liveness: the process is up and serving requests (warm-up may still be running)."""
+    return jsonify({"status": "alive"})
+
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: warm-up has finished and chat requests can be answered."""
+    if not ready.is_set():
+        response = jsonify({"status": "starting", "startup": startup_stats()})
+        response.headers['Retry-After'] = STARTING_RETRY_AFTER
+        return response, 503
+    return jsonify({"status": "ready", "startup": startup_stats()})
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
+    snap = snapshot
     return jsonify({
-        "status": "healthy", 
+        "status": "healthy" if ready.is_set() else "starting",
         "message": "Chatbot API is running",
-        "knowledge_base_size": len(knowledge_base),
-        "embeddings_loaded": len(document_embeddings) > 0
+        "ready": ready.is_set(),
+        "startup": startup_stats(),
+        "knowledge_base_size": len(snap.knowledge_base),
+        "embeddings_loaded": len(snap.vectors) > 0,
+        "index": snap.stats(),
+        "cache": {
+            "query_embeddings": query_embedding_cache.stats(),
+            "answers": answer_cache.stats(),
+            "semantic_answers": semantic_cache.stats()
+        },
+        "tokens": token_meter.stats(),
+        "coalescing": coalescing_stats(),
+        "sessions": session_store.stats(),
+        "password_hashing": password_hasher.stats(),
+        "upstream": gemini_limiter.stats()
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics for this worker process."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@metrics.register_collector
+def collect_app_stats():
+    """Export the stats /health reports (caches, tokens, upstream limits, sessions, hashing, index)."""
+    caches = {"query_embeddings": query_embedding_cache.stats(), "answers": answer_cache.stats(),
+              "semantic_answers": semantic_cache.stats()}
+    for field, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"),
+                        ("expirations", "counter"), ("entries", "gauge")):
+        suffix = "_total" if kind == "counter" else ""
+        yield (f"chatbot_cache_{field}{suffix}", kind, f"Cache {field}.",
+               [({"cache": name}, stats[field]) for name, stats in caches.items()])
+    yield ("chatbot_semantic_cache_near_misses_total", "counter",
+           "Semantic cache lookups with a similar question that had retrieved different sources.",
+           [({}, caches["semantic_answers"]["near_misses"])])
+
+    tokens = token_meter.stats()
+    yield ("chatbot_prompt_tokens_total", "counter", "Prompt tokens sent to Gemini.",
+           [({}, tokens["prompt_tokens"])])
+    yield ("chatbot_response_tokens_total", "counter", "Response tokens generated by Gemini.",
+           [({}, tokens["response_tokens"])])
+    yield ("chatbot_chat_requests_total", "counter", "Chat answers served, by source.",
+           [({"source": "generated"}, tokens["requests"] - tokens["cached"] - tokens["shared"]),
+            ({"source": "cache"}, tokens["cached"]),
+            ({"source": "shared"}, tokens["shared"])])
+    flights = coalescing_stats()
+    yield ("chatbot_coalesced_calls_total", "counter", "Upstream calls made on behalf of coalesced requests.",
+           [({"call": name}, stats["calls"]) for name, stats in flights.items()])
+    yield ("chatbot_coalesced_shared_total", "counter", "Requests that reused an identical in-flight upstream call.",
+           [({"call": name}, stats["shared"]) for name, stats in flights.items()])
+
+    hashing = password_hasher.stats()
+    yield ("chatbot_password_hash_in_flight", "gauge", "Password hash jobs running or queued.",
+           [({}, hashing["in_flight"])])
+    yield ("chatbot_password_hash_rejected_total", "counter", "Password hash jobs rejected (queue full or timeout).",
+           [({}, hashing["rejected"])])
+
+    upstream = gemini_limiter.stats()
+    yield ("chatbot_upstream_in_flight", "gauge", "Gemini calls in flight across all workers.",
+           [({"priority": name}, count) for name, count in upstream["in_flight"].items()])
+    yield ("chatbot_upstream_acquired_total", "counter", "Gemini calls admitted by the shared limiter.",
+           [({"priority": name}, count) for name, count in upstream["acquired"].items()])
+    yield ("chatbot_upstream_rejected_total", "counter", "Gemini calls given up as busy (no slot in time, or 429 after every retry).",
+           [({}, upstream["rejected"])])
+    yield ("chatbot_upstream_retries_total", "counter", "Gemini calls retried after a 429 or unavailable error.",
+           [({}, upstream["retries"])])
+
+    sessions = session_store.stats()
+    yield ("chatbot_sessions", "gauge", "Conversation sessions held by the session store.",
+           [({"backend": sessions["backend"]}, sessions["sessions"])])
+
+    startup = startup_stats()
+    yield ("chatbot_ready", "gauge", "1 once warm-up has finished.", [({}, int(startup["ready"]))])
+    if startup["warm_up_seconds"] is not None:
+        yield ("chatbot_warm_up_seconds", "gauge", "Time taken by startup warm-up.",
+               [({}, startup["warm_up_seconds"])])
+
+    snap = snapshot.stats()
+    yield ("chatbot_index_version", "gauge", "Version of the live index snapshot.", [({}, snap["version"])])
+    yield ("chatbot_index_documents", "gauge", "Documents in the live index snapshot.", [({}, snap["documents"])])
+    yield ("chatbot_index_embeddings", "gauge", "Embeddings in the live index snapshot.", [({}, snap["embeddings"])])
+    yield ("chatbot_index_code_bytes", "gauge", "Memory held by quantized embedding codes.", [({}, snap["code_bytes"])])
+
 # --- AUTH ENDPOINTS ---
 
 @app.route('/register', methods=['POST'])
+@profiled("register")
 def register():
     data = request.json
     email = data.get('email')
@@ -256,13 +586,15 @@ def register():
     if not email or not password:
         return jsonify({"error": "Email and password are required"}), 400
 
-    hashed_password = generate_password_hash(password)
+    try:
+        with span("password_hash"):
+            hashed_password = password_hasher.hash_password(password)
+    except HasherBusy:
+        return hasher_busy_response()
 
     try:
-        with sqlite3.connect(DB_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO users (email, password, role) VALUES (?, ?, ?)", (email, hashed_password, role))
-            conn.commit()
+        with span("db_create_user"):
+            db.create_user(email, hashed_password, role)
         return jsonify({"message": "User registered successfully", "role": role}), 201
     except sqlite3.IntegrityError:
         return jsonify({"error": "Email already exists"}), 409
@@ -270,6 +602,7 @@ def register():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/login', methods=['POST'])
+@profiled("login")
 def login():
     data = request.json
     email = data.get('email')
@@ -278,19 +611,23 @@ def login():
     if not email or not password:
         return jsonify({"error": "Email and password are required"}), 400
 
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-        user = cursor.fetchone()
+    with span("db_get_login_user"):
+        user = db.get_login_user(email)
+
+    # User indexes: 0:id, 1:email, 2:password, 3:role
+    try:
+        with span("password_verify"):
+            password_ok = user is not None and password_hasher.verify_password(user[2], password)
+    except HasherBusy:
+        return hasher_busy_response()
 
-    # User indexes: 0:id, 1:email, 2:password, 3:role, 4:created_at
-    if user and check_password_hash(user[2], password):
+    if password_ok:
         return jsonify({
             "message": "Login successful",
             "user": {
                 "id": user[0], 
                 "email": user[1],
-                "role": user[3] if len(user) > 3 else "client"
+                "role": user[3] or "client"
             },
             "token": "mock-jwt-token-xyz-123" 
         }), 200
@@ -304,10 +641,8 @@ def get_profile():
     if not email:
         return jsonify({"error": "Unauthorized - Provide email as query param for mock profile demo"}), 401
     
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, email, role FROM users WHERE email = ?", (email,))
-        user = cursor.fetchone()
+    with span("db_get_profile"):
+        user = db.get_profile(email)
     
     if user:
         return jsonify({
@@ -320,12 +655,104 @@ def get_profile():
 
 # --- CHATBOT ENDPOINTS ---
 
+def answer_cache_key(question, chunk_ids, recent_history):
+    """Key a generated answer by question, retrieved chunks and recent history."""
+    history_hash = hashlib.sha1(
+        json.dumps(recent_history, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+    return (normalize_query(question), tuple(chunk_ids), history_hash)
+
+def chat_filters(data):
+    """RetrievalFilter for a chat request body.
+
+    Optional "filters": {"source": ..., "page_type": ..., "exclude_page_type": ...}
+    (each a string or list). The user's role (users.role) comes from "email",
+    mocked like /profile; anonymous users only see pages meant for everyone.
+    Raises ValueError for a malformed filter.
+    """
+    role = None
+    email = data.get('email')
+    if email:
+        with span("db_get_profile"):
+            user = db.get_profile(email)
+        if user:
+            role = user[2]
+    return RetrievalFilter.from_request(data.get('filters'), role)
+
+def prepare_chat(user_message, session_id, relevant_docs=None, filters=None):
+    """Retrieve context and build the prompt for one chat turn.
+
+    relevant_docs skips retrieval when the caller already searched;
+    filters (a RetrievalFilter) limits what retrieval may return.
+    Returns (prompt, sources, cache_key); prompt.text is what gets sent to Gemini.
+    """
+    # Get conversation history for this session
+    with span("session_load"):
+        history = session_store.get_history(session_id)
+    
+    # Search knowledge base for relevant context using semantic search
+    if relevant_docs is None:
+        relevant_docs = semantic_search(user_message, top_k=RETRIEVAL_TOP_K, filters=filters)
+    
+    # Fit history and the best chunks into the prompt token budget
+    with span("prompt_build"):
+        prompt = build_prompt(SYSTEM_PROMPT, user_message, relevant_docs, history)
+    
+    # Track sources (one entry per page, in rank order)
+    sources = list(dict.fromkeys(doc['source'] for doc in prompt.docs))
+    chunk_ids = [doc.get('id', doc['source']) for doc in prompt.docs]
+    
+    cache_key = answer_cache_key(user_message, chunk_ids, prompt.history)
+    return prompt, sources, cache_key
+
+def record_exchange(session_id, question, answer):
+    """Add a finished exchange to the session history (the store keeps the last 10)."""
+    with span("session_save"):
+        session_store.append(session_id, question, answer)
+
+def semantic_cache_embedding(question):
+    """Query embedding for the semantic answer cache, or None if the cache is off or embedding failed.
+
+    Retrieval has just embedded the question, so this is normally a query cache hit.
+    UpstreamBusy propagates, so the request answers busy without waiting again.
+    """
+    if semantic_cache.max_entries <= 0:
+        return None
+    try:
+        return embed_query(question)
+    except UpstreamBusy:
+        raise
+    except Exception as e:
+        print(f"Semantic cache skipped: {e}")
+        return None
+
+def generate_answer(prompt, cache_key):
+    """Call Gemini for a prompt and cache the answer. Returns (answer, usage)."""
+    with span("generate"):
+        response = gemini_limiter.call(
+            lambda: model.generate_content(prompt.text, generation_config=generation_config())
+        )
+        answer = response.text.strip()
+    answer_cache.set(cache_key, answer)
+    return answer, response_usage(response, prompt, answer)
+
+def generation_config():
+    # generate_content accepts a plain dict wherever it takes a GenerationConfig
+    return {
+        "temperature": 0.7,
+        "max_output_tokens": 500,
+    }
+
 @app.route('/chat', methods=['POST'])
+@profiled("chat")
 def chat():
     """
     Handle chat requests with RAG (Retrieval Augmented Generation).
-    Expected JSON: {"message": "user message", "session_id": "optional_session_id"}
+    Expected JSON: {"message": "user message", "session_id": "optional_session_id",
+                    "email": "optional, for role-specific pages", "filters": {optional}}
     """
+    if not ready.is_set():
+        return starting_response()
     try:
         data = request.json
         user_message = data.get('message', '').strip()
@@ -333,80 +760,148 @@ def chat():
         
         if not user_message:
             return jsonify({"error": "No message provided"}), 400
+        try:
+            filters = chat_filters(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        # Get conversation history for this session
-        if session_id not in conversation_histories:
-            conversation_histories[session_id] = []
-        history = conversation_histories[session_id]
-        
-        # Search knowledge base for relevant context using semantic search
-        relevant_docs = semantic_search(user_message, top_k=3)
-        
-        # Build context from relevant documents
-        context = "\n\n".join([
-            f"📄 {doc['title']}:\n{doc['content']}"
-            for doc in relevant_docs
-        ])
-        
-        # Build conversation context
-        conv_context = ""
-        if history:
-            recent_history = history[-4:]  # Last 2 exchanges
-            conv_context = "\n\nRecent conversation:\n"
-            for h in recent_history:
-                conv_context += f"Customer: {h['question']}\nAssistant: {h['answer']}\n"
-        
-        # Create the full prompt
-        full_prompt = f"""{SYSTEM_PROMPT}
-
----
-Relevant Context from Our Website:
-{context}
-{conv_context}
----
-
-Customer Question: {user_message}
-
-Please provide a helpful, friendly response:"""
-        
-        # Get response from Gemini
-        response = model.generate_content(
-            full_prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.7,
-                max_output_tokens=500,
-            )
-        )
-        answer = response.text.strip()
-        
-        # Track sources
-        sources = [doc['source'] for doc in relevant_docs]
+        prompt, sources, cache_key = prepare_chat(user_message, session_id, filters=filters)
         
-        # Add to conversation history
-        history.append({
-            'question': user_message,
-            'answer': answer
-        })
+        # Get response from Gemini (or a cached answer for the same question and context)
+        answer = answer_cache.get(cache_key)
+        query_embedding = None
+        if answer is None and not prompt.history:
+            query_embedding = semantic_cache_embedding(user_message)
+            if query_embedding is not None:
+                answer = semantic_cache.get(query_embedding, sources[:SEMANTIC_CACHE_SOURCES], scope=filters.key())
+        if answer is None:
+            if prompt.history:
+                answer, usage = generate_answer(prompt, cache_key)
+            else:
+                # No history: the prompt depends only on the question, so identical
+                # in-flight questions can share one generation
+                (answer, usage), shared = generate_flight.do(
+                    cache_key, lambda: generate_answer(prompt, cache_key)
+                )
+                if shared:
+                    usage = cached_usage(answer, counted_by="shared")
+                elif query_embedding is not None:
+                    semantic_cache.set(query_embedding, sources[:SEMANTIC_CACHE_SOURCES], answer, scope=filters.key())
+        else:
+            usage = cached_usage(answer)
         
-        # Keep only last 10 exchanges per session
-        if len(history) > 10:
-            conversation_histories[session_id] = history[-10:]
+        record_exchange(session_id, user_message, answer)
+        token_meter.record(usage)
         
         return jsonify({
             "response": answer,
-            "sources": sources
+            "sources": sources,
+            "usage": usage
         })
     
+    except UpstreamBusy as e:
+        return upstream_busy_response(e)
     except Exception as e:
         print(f"Error in chat endpoint: {e}")
+        metrics.CHAT_ERRORS.inc(endpoint="chat")
         import traceback
         traceback.print_exc()
         return jsonify({
-            "error": "I apologize, but I'm having trouble processing your request. Please try again or contact us directly.",
+            "error": CHAT_ERROR_MESSAGE,
             "details": str(e)
         }), 500
 
 
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Stream a chat answer as Server-Sent Events.
+    Expected JSON: same as /chat. Emits `token` events ({"text": ...}) as Gemini
+    generates, then `sources` ({"sources": [...]}) and `done` ({"response": full answer,
+    "usage": token counts}).
+    Failures are sent as an `error` event; when Gemini is busy it carries `retry_after` (seconds).
+    """
+    if not ready.is_set():
+        return starting_response()
+    data = request.json or {}
+    user_message = data.get('message', '').strip()
+    session_id = data.get('session_id', 'default')
+    
+    if not user_message:
+        return jsonify({"error": "No message provided"}), 400
+    try:
+        filters = chat_filters(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    def generate():
+        try:
+            prompt, sources, cache_key = prepare_chat(user_message, session_id, filters=filters)
+            
+            answer = answer_cache.get(cache_key)
+            query_embedding = None
+            if answer is None and not prompt.history:
+                query_embedding = semantic_cache_embedding(user_message)
+                if query_embedding is not None:
+                    answer = semantic_cache.get(query_embedding, sources[:SEMANTIC_CACHE_SOURCES], scope=filters.key())
+            if answer is not None:
+                yield sse_event("token", {"text": answer})
+                usage = cached_usage(answer)
+            else:
+                parts = []
+                started = time.perf_counter()
+                # The slot is held until the stream ends; a stream cannot be retried once it has started
+                with gemini_limiter.slot(CHAT):
+                    response = model.generate_content(
+                        prompt.text,
+                        generation_config=generation_config(),
+                        stream=True
+                    )
+                    for chunk in response:
+                        try:
+                            text = chunk.text
+                        except ValueError:
+                            continue  # chunk without text parts (e.g. final finish_reason)
+                        if text:
+                            if not parts:
+                                metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage="generate_first_token")
+                            parts.append(text)
+                            yield sse_event("token", {"text": text})
+                metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage="generate_stream")
+                answer = "".join(parts).strip()
+                answer_cache.set(cache_key, answer)
+                if query_embedding is not None:
+                    semantic_cache.set(query_embedding, sources[:SEMANTIC_CACHE_SOURCES], answer, scope=filters.key())
+                usage = response_usage(response, prompt, answer)
+            
+            record_exchange(session_id, user_message, answer)
+            token_meter.record(usage)
+            
+            yield sse_event("sources", {"sources": sources})
+            yield sse_event("done", {"response": answer, "usage": usage})
+        
+        except UpstreamBusy as e:
+            yield sse_event("error", {"error": UPSTREAM_BUSY_MESSAGE,
+                                      "retry_after": int(e.retry_after_header)})
+        except Exception as e:
+            print(f"Error in chat stream endpoint: {e}")
+            metrics.CHAT_ERRORS.inc(endpoint="chat_stream")
+            import traceback
+            traceback.print_exc()
+            yield sse_event("error", {"error": CHAT_ERROR_MESSAGE, "details": str(e)})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/clear', methods=['POST'])
 def clear_history():
     """Clear conversation history for a session."""
@@ -414,8 +909,7 @@ def clear_history():
         data = request.json or {}
         session_id = data.get('session_id', 'default')
         
-        if session_id in conversation_histories:
-            conversation_histories[session_id] = []
+        session_store.clear(session_id)
         
         return jsonify({"message": "Conversation history cleared"})
     except Exception as e:
@@ -424,23 +918,83 @@ def clear_history():
 
 @app.route('/regenerate-embeddings', methods=['POST'])
 def regenerate_embeddings():
-    """Regenerate all document embeddings."""
+    """Re-embed new or changed documents (all of them with ?full=1), then swap in the new index.
+
+    Chat keeps answering from the current snapshot while this runs.
+    """
+    if embed_lock.locked():
+        return jsonify({"error": "Embedding regeneration already in progress"}), 409
     try:
-        generate_all_embeddings()
+        full = request.args.get('full', '').lower() in ('1', 'true', 'yes')
+        stats = generate_all_embeddings(full=full)
+        if stats is None:
+            return jsonify({"error": "Embedding regeneration failed; see the server log"}), 500
         return jsonify({
             "message": "Embeddings regenerated successfully",
-            "count": len(document_embeddings)
+            "count": len(snapshot.vectors),
+            "version": snapshot.version,
+            "stats": stats
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-# Initialize on startup
-load_knowledge_base()
-load_embeddings()
+def install_reload_signal():
+    """`kill -HUP <pid>` reloads the index in the background (POSIX, main thread only)."""
+    if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGHUP, lambda signum, frame: reload_in_background("SIGHUP"))
+
 
-print("Chatbot initialized successfully!")
+def warm_up():
+    """Load the index snapshot and the Gemini SDK, then mark the app ready."""
+    global warm_up_seconds, startup_error
+    started = time.perf_counter()
+    try:
+        reload_index("startup")
+        index_watcher.start()
+        session_store.resolve()
+        model.resolve()  # imports and configures google.generativeai
+    except Exception as e:
+        startup_error = str(e)
+        print(f"Error during warm-up: {e}")
+        return
+    warm_up_seconds = time.perf_counter() - started
+    ready.set()
+    print(f"Chatbot initialized successfully! (warm-up {warm_up_seconds:.2f}s)")
+
+def shutdown():
+    """Stop the index watcher and the password hashing pool. create_app() registers this to run at exit."""
+    index_watcher.stop()
+    password_hasher.shutdown()
+
+def create_app(background=True):
+    """Prepare the app for serving and return it. Safe to call more than once.
+
+    Creates the database schema, installs the SIGHUP handler and registers
+    shutdown() to run at exit, then runs warm_up() - in a background thread
+    unless background=False - so the server can bind and answer /health/live
+    straight away.
+    """
+    global app_started
+    with startup_lock:
+        if not app_started:
+            app_started = True
+            db.init_schema()
+            install_reload_signal()
+            atexit.register(shutdown)
+            if background:
+                threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+            else:
+                warm_up()
+    return app
+
+@app.before_request
+def start_on_first_request():
+    # For servers given the module-level app (app:app) instead of create_app()
+    if not app_started:
+        create_app()
 
 
 if __name__ == '__main__':
+    create_app()
     app.run(debug=True, host='0.0.0.0', port=5000)
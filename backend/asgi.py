@@ -0,0 +1,312 @@
+"""
+ASGI entry point for the chatbot API.
+
+/chat and /chat/stream run as coroutines on the async Gemini client, so a
+request waiting on Gemini no longer holds a worker thread. Every other route
+(/clear, /health, auth, static files) is served by the Flask app in app.py.
+
+Importing this module calls app.create_app(), so warm-up starts in the
+background as soon as a worker loads it.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+
+import json
+import time
+import asyncio
+import traceback
+from asgiref.wsgi import WsgiToAsgi
+import app as chatbot
+from metrics import span, REQUEST_SECONDS, STAGE_SECONDS, FALLBACKS, CHAT_ERRORS
+from upstream_limiter import UpstreamBusy, CHAT
+
+flask_app = WsgiToAsgi(chatbot.create_app())
+
+CORS_HEADERS = [(b"access-control-allow-origin", b"*")]
+
+
+async def fetch_query_embedding_async(query, key):
+    with span("embed_query"):
+        result = await chatbot.gemini_limiter.call_async(lambda: chatbot.genai.embed_content_async(
+            model=chatbot.EMBEDDING_MODEL,
+            content=query,
+            task_type="retrieval_query"
+        ))
+    embedding = result['embedding']
+    chatbot.query_embedding_cache.set(key, embedding)
+    return embedding
+
+
+async def embed_query_async(query):
+    """Async counterpart of app.embed_query, sharing its cache; identical misses share one call."""
+    key = chatbot.normalize_query(query)
+    embedding = chatbot.query_embedding_cache.get(key)
+    if embedding is None:
+        embedding, _ = await chatbot.async_embed_flight.do(
+            key, lambda: fetch_query_embedding_async(query, key)
+        )
+    return embedding
+
+
+async def generate_answer_async(prompt, cache_key):
+    """Async counterpart of app.generate_answer. Returns (answer, usage)."""
+    with span("generate"):
+        response = await chatbot.gemini_limiter.call_async(lambda: chatbot.model.generate_content_async(
+            prompt.text, generation_config=chatbot.generation_config()
+        ))
+        answer = response.text.strip()
+    chatbot.answer_cache.set(cache_key, answer)
+    return answer, chatbot.response_usage(response, prompt, answer)
+
+
+async def semantic_cache_embedding_async(question):
+    """Async counterpart of app.semantic_cache_embedding."""
+    if chatbot.semantic_cache.max_entries <= 0:
+        return None
+    try:
+        return await embed_query_async(question)
+    except UpstreamBusy:
+        raise
+    except Exception as e:
+        print(f"Semantic cache skipped: {e}")
+        return None
+
+
+async def prepare_chat_async(user_message, session_id, filters=None):
+    """Embed the query without blocking, then score, load history and build the prompt in threads."""
+    try:
+        query_embedding = await embed_query_async(user_message)
+    except UpstreamBusy:
+        raise  # answer busy now rather than wait again for the cache and the answer
+    except Exception as e:
+        print(f"Semantic search error: {e}")
+        FALLBACKS.inc(reason="error")
+        relevant_docs = await asyncio.to_thread(
+            chatbot.keyword_search, user_message, chatbot.RETRIEVAL_TOP_K, None, filters
+        )
+    else:
+        relevant_docs = await asyncio.to_thread(
+            chatbot.semantic_search, user_message, chatbot.RETRIEVAL_TOP_K, query_embedding, None, filters
+        )
+    # Session history may be a SQLite read; keep it off the event loop
+    return await asyncio.to_thread(chatbot.prepare_chat, user_message, session_id, relevant_docs)
+
+
+async def read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(body) if body else {}
+    except ValueError:
+        return None
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json")] + list(headers) + CORS_HEADERS,
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def read_chat_request(receive, send):
+    """Parse a /chat body; returns (message, session_id, filters) or None after sending a 400."""
+    data = await read_json(receive)
+    if not isinstance(data, dict):
+        await send_json(send, 400, {"error": "Invalid JSON body"})
+        return None
+    user_message = str(data.get('message', '')).strip()
+    if not user_message:
+        await send_json(send, 400, {"error": "No message provided"})
+        return None
+    try:
+        filters = await asyncio.to_thread(chatbot.chat_filters, data)
+    except ValueError as e:
+        await send_json(send, 400, {"error": str(e)})
+        return None
+    return user_message, data.get('session_id', 'default'), filters
+
+
+async def chat(scope, receive, send):
+    """Async version of app.chat with the same request and response shape."""
+    parsed = await read_chat_request(receive, send)
+    if parsed is None:
+        return
+    user_message, session_id, filters = parsed
+
+    try:
+        prompt, sources, cache_key = await prepare_chat_async(user_message, session_id, filters)
+
+        answer = chatbot.answer_cache.get(cache_key)
+        query_embedding = None
+        if answer is None and not prompt.history:
+            query_embedding = await semantic_cache_embedding_async(user_message)
+            if query_embedding is not None:
+                answer = chatbot.semantic_cache.get(query_embedding, sources[:chatbot.SEMANTIC_CACHE_SOURCES], scope=filters.key())
+        if answer is None:
+            if prompt.history:
+                answer, usage = await generate_answer_async(prompt, cache_key)
+            else:
+                (answer, usage), shared = await chatbot.async_generate_flight.do(
+                    cache_key, lambda: generate_answer_async(prompt, cache_key)
+                )
+                if shared:
+                    usage = chatbot.cached_usage(answer, counted_by="shared")
+                elif query_embedding is not None:
+                    chatbot.semantic_cache.set(query_embedding, sources[:chatbot.SEMANTIC_CACHE_SOURCES], answer, scope=filters.key())
+        else:
+            usage = chatbot.cached_usage(answer)
+
+        await asyncio.to_thread(chatbot.record_exchange, session_id, user_message, answer)
+        chatbot.token_meter.record(usage)
+        await send_json(send, 200, {"response": answer, "sources": sources, "usage": usage})
+
+    except UpstreamBusy as e:
+        await send_json(send, 503, {"error": chatbot.UPSTREAM_BUSY_MESSAGE},
+                        [(b"retry-after", e.retry_after_header.encode())])
+    except Exception as e:
+        print(f"Error in chat endpoint: {e}")
+        traceback.print_exc()
+        CHAT_ERRORS.inc(endpoint="chat")
+        await send_json(send, 500, {"error": chatbot.CHAT_ERROR_MESSAGE, "details": str(e)})
+
+
+async def chat_stream(scope, receive, send):
+    """Async version of app.chat_stream (Server-Sent Events)."""
+    parsed = await read_chat_request(receive, send)
+    if parsed is None:
+        return
+    user_message, session_id, filters = parsed
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ] + CORS_HEADERS,
+    })
+
+    async def emit(event, data):
+        await send({
+            "type": "http.response.body",
+            "body": chatbot.sse_event(event, data).encode("utf-8"),
+            "more_body": True,
+        })
+
+    try:
+        prompt, sources, cache_key = await prepare_chat_async(user_message, session_id, filters)
+
+        answer = chatbot.answer_cache.get(cache_key)
+        query_embedding = None
+        if answer is None and not prompt.history:
+            query_embedding = await semantic_cache_embedding_async(user_message)
+            if query_embedding is not None:
+                answer = chatbot.semantic_cache.get(query_embedding, sources[:chatbot.SEMANTIC_CACHE_SOURCES], scope=filters.key())
+        if answer is not None:
+            await emit("token", {"text": answer})
+            usage = chatbot.cached_usage(answer)
+        else:
+            parts = []
+            started = time.perf_counter()
+            async with chatbot.gemini_limiter.slot_async(CHAT):
+                response = await chatbot.model.generate_content_async(
+                    prompt.text, generation_config=chatbot.generation_config(), stream=True
+                )
+                async for chunk in response:
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        continue
+                    if text:
+                        if not parts:
+                            STAGE_SECONDS.observe(time.perf_counter() - started, stage="generate_first_token")
+                        parts.append(text)
+                        await emit("token", {"text": text})
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="generate_stream")
+            answer = "".join(parts).strip()
+            chatbot.answer_cache.set(cache_key, answer)
+            if query_embedding is not None:
+                chatbot.semantic_cache.set(query_embedding, sources[:chatbot.SEMANTIC_CACHE_SOURCES], answer, scope=filters.key())
+            usage = chatbot.response_usage(response, prompt, answer)
+
+        await asyncio.to_thread(chatbot.record_exchange, session_id, user_message, answer)
+        chatbot.token_meter.record(usage)
+        await emit("sources", {"sources": sources})
+        await emit("done", {"response": answer, "usage": usage})
+
+    except UpstreamBusy as e:
+        await emit("error", {"error": chatbot.UPSTREAM_BUSY_MESSAGE,
+                             "retry_after": int(e.retry_after_header)})
+    except Exception as e:
+        print(f"Error in chat stream endpoint: {e}")
+        traceback.print_exc()
+        CHAT_ERRORS.inc(endpoint="chat_stream")
+        await emit("error", {"error": chatbot.CHAT_ERROR_MESSAGE, "details": str(e)})
+
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def send_starting(scope, receive, send):
+    """Async counterpart of app.starting_response: 503 until warm-up has finished."""
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"retry-after", chatbot.STARTING_RETRY_AFTER.encode())] + CORS_HEADERS,
+    })
+    await send({"type": "http.response.body",
+                "body": json.dumps({"error": "Server is starting, please try again shortly"}).encode("utf-8")})
+
+
+ASYNC_ROUTES = {
+    ("POST", "/chat"): chat,
+    ("POST", "/chat/stream"): chat_stream,
+}
+
+
+async def timed(handler, scope, receive, send):
+    """Run an async route, recording its latency like app.observe_request_time."""
+    started = time.perf_counter()
+    status = []
+
+    async def send_with_status(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+        await send(message)
+
+    try:
+        await handler(scope, receive, send_with_status)
+    finally:
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            method=scope["method"], route=scope["path"], status=status[0] if status else 500
+        )
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "http":
+        handler = ASYNC_ROUTES.get((scope["method"], scope["path"]))
+        if handler is not None:
+            if not chatbot.ready.is_set():
+                handler = send_starting
+            await timed(handler, scope, receive, send)
+            return
+    if scope["type"] == "lifespan":
+        # The Flask app has no startup/shutdown hooks
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    await flask_app(scope, receive, send)
@@ -0,0 +1,134 @@
+"""
+Load test: concurrency vs latency for /chat, async (asgi.py) vs sync Flask.
+Latency is measured from when the whole batch is submitted, so queueing counts.
+
+Gemini is replaced by fake_genai.FakeGenAI with fixed embedding/generation latency, and
+requests are driven in-process, so no API key or server is needed. The sync
+run pushes the same load through the Flask app with a fixed number of worker
+threads, like `gunicorn --threads N`.
+
+Usage: python bench_asgi_load.py [--concurrency 1 10 100 500] [--gen-latency 1.0]
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+import app as chatbot
+import asgi
+from vector_index import VectorIndex
+from bm25_index import BM25Index
+from embedding_pipeline import document_text
+from index_snapshot import IndexSnapshot
+from fake_genai import FakeGenAI
+
+DIM = 64
+
+
+def install_fake_gemini(embed_latency, gen_latency):
+    """Swap Gemini calls for fake_genai's sleeps; patches the app module in place."""
+    # Importing asgi started warm-up; let it finish so it cannot swap the snapshot built below
+    chatbot.ready.wait(120)
+    rng = np.random.default_rng(0)
+    FakeGenAI(embed_latency=embed_latency, gen_latency=gen_latency, dim=DIM).install(chatbot)
+
+    # Unique questions and no caching, so every request goes "upstream"
+    chatbot.query_embedding_cache.max_entries = 0
+    chatbot.answer_cache.max_entries = 0
+    chatbot.semantic_cache.max_entries = 0
+    # Measures how many requests one event loop keeps in flight, so Gemini limits are off
+    chatbot.gemini_limiter.enabled = False
+
+    docs = chatbot.snapshot.knowledge_base or [
+        {"source": f"doc{i}", "title": f"Doc {i}", "description": "", "content": "Lorem ipsum."}
+        for i in range(50)
+    ]
+    n = len(docs)
+    chatbot.snapshot = IndexSnapshot(
+        docs, BM25Index.build(document_text(doc) for doc in docs),
+        VectorIndex(rng.standard_normal((n, DIM)), np.arange(n)),
+    )
+
+
+async def asgi_request(message, batch_start):
+    body = json.dumps({"message": message, "session_id": message}).encode()
+    scope = {"type": "http", "method": "POST", "path": "/chat", "headers": []}
+    sent = False
+    status = []
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            await asyncio.sleep(3600)
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await asgi.app(scope, receive, send)
+    return time.perf_counter() - batch_start, status[0]
+
+
+async def run_asgi(concurrency):
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        asgi_request(f"asgi {concurrency} {i}", start) for i in range(concurrency)
+    ])
+    return results, time.perf_counter() - start
+
+
+def run_sync(concurrency, threads):
+    client = chatbot.app.test_client()
+
+    start = time.perf_counter()
+
+    def one(i):
+        message = f"sync {concurrency} {i}"
+        response = client.post('/chat', json={"message": message, "session_id": message})
+        return time.perf_counter() - start, response.status_code
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(one, range(concurrency)))
+    return results, time.perf_counter() - start
+
+
+def report(label, concurrency, results, wall):
+    latencies = [r[0] * 1000 for r in results]
+    errors = sum(1 for r in results if r[1] != 200)
+    print(f"{label:>14} {concurrency:>6} {np.percentile(latencies, 50):>10.0f} "
+          f"{np.percentile(latencies, 99):>10.0f} {len(results) / wall:>8.1f} {errors:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 100, 500])
+    parser.add_argument('--embed-latency', type=float, default=0.1)
+    parser.add_argument('--gen-latency', type=float, default=1.0)
+    parser.add_argument('--sync-threads', type=int, default=8,
+                        help="Worker threads for the sync Flask baseline")
+    parser.add_argument('--skip-sync', action='store_true')
+    args = parser.parse_args()
+
+    install_fake_gemini(args.embed_latency, args.gen_latency)
+
+    print(f"embed={args.embed_latency}s generate={args.gen_latency}s "
+          f"sync threads={args.sync_threads}")
+    print(f"{'server':>14} {'conc':>6} {'p50 ms':>10} {'p99 ms':>10} {'req/s':>8} {'errors':>6}")
+    for concurrency in args.concurrency:
+        results, wall = asyncio.run(run_asgi(concurrency))
+        report("asgi", concurrency, results, wall)
+        if not args.skip_sync:
+            results, wall = run_sync(concurrency, args.sync_threads)
+            report(f"flask x{args.sync_threads}", concurrency, results, wall)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Concurrency benchmark for the auth database layer: register/login throughput.
+
+Compares the old pattern (a new sqlite3 connection per request, rollback
+journal) with database.Database (per-thread WAL connections). Password
+hashing is left out so the numbers reflect SQLite alone.
+
+Usage: python bench_auth_db.py [--threads 1 8 32] [--users 2000]
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from database import Database, SCHEMA, INSERT_USER, SELECT_LOGIN
+
+
+class LegacyDatabase:
+    """The pre-database.py access pattern from app.py."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def init_schema(self):
+        with sqlite3.connect(self.path) as conn:
+            conn.execute(SCHEMA)
+
+    def create_user(self, email, password_hash, role):
+        with sqlite3.connect(self.path) as conn:
+            conn.execute(INSERT_USER, (email, password_hash, role))
+            conn.commit()
+
+    def get_login_user(self, email):
+        with sqlite3.connect(self.path) as conn:
+            return conn.execute(SELECT_LOGIN, (email,)).fetchone()
+
+
+def run(db, threads, users, read_ratio):
+    """Register `users` users, then do read_ratio logins per user, all from `threads` threads."""
+    errors = {"locked": 0, "other": 0}
+    lock = threading.Lock()
+
+    def guarded(fn, *args):
+        try:
+            fn(*args)
+        except sqlite3.OperationalError as e:
+            with lock:
+                errors["locked" if "locked" in str(e) else "other"] += 1
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        start = time.perf_counter()
+        list(pool.map(lambda i: guarded(db.create_user, f"user{i}@example.com", "x" * 100, "client"),
+                      range(users)))
+        register_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        list(pool.map(lambda i: guarded(db.get_login_user, f"user{i % users}@example.com"),
+                      range(users * read_ratio)))
+        login_time = time.perf_counter() - start
+    return users / register_time, users * read_ratio / login_time, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--logins-per-user', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"users={args.users} logins/user={args.logins_per_user}")
+    print(f"{'impl':>8} {'threads':>8} {'register/s':>12} {'login/s':>10} {'locked':>7} {'other':>6}")
+    for threads in args.threads:
+        for name, factory in (("legacy", LegacyDatabase), ("pooled", Database)):
+            with tempfile.TemporaryDirectory() as tmp:
+                db = factory(os.path.join(tmp, "users.db"))
+                db.init_schema()
+                register_rate, login_rate, errors = run(db, threads, args.users, args.logins_per_user)
+            print(f"{name:>8} {threads:>8} {register_rate:>12.0f} {login_rate:>10.0f} "
+                  f"{errors['locked']:>7} {errors['other']:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Recall@k and latency of the IVF index against exact search.
+Uses synthetic clustered embeddings, so no Gemini API key is needed.
+
+Usage: python bench_ivf_recall.py [--docs 100000] [--dim 768] [--nprobe 1 4 8 16 32]
+"""
+
+import argparse
+import time
+import numpy as np
+from vector_index import VectorIndex
+from ivf_index import IVFIndex
+
+
+def synthetic_corpus(rng, n, dim, topics):
+    """Documents scattered around a few hundred topic directions, like real chunks."""
+    centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    labels = rng.integers(0, topics, size=n)
+    noise = rng.standard_normal((n, dim)).astype(np.float32) * 1.5
+    return centers[labels] + noise, centers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--topics', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors, centers = synthetic_corpus(rng, args.docs, args.dim, args.topics)
+    exact = VectorIndex(vectors, np.arange(args.docs))
+    del vectors
+
+    # Queries land between topics so neighbours spill across several lists
+    query_topics = rng.integers(0, args.topics, size=(args.queries, 2))
+    queries = (centers[query_topics].sum(axis=1)
+               + rng.standard_normal((args.queries, args.dim)).astype(np.float32))
+
+    start = time.perf_counter()
+    ivf = IVFIndex.build(exact, nlist=args.nlist)
+    print(f"docs={args.docs} dim={args.dim} nlist={ivf.nlist} "
+          f"build={time.perf_counter() - start:.1f}s top_k={args.top_k}")
+
+    truth = []
+    exact_ms = []
+    for q in queries:
+        start = time.perf_counter()
+        truth.append({i for i, _ in exact.search(q, args.top_k)})
+        exact_ms.append((time.perf_counter() - start) * 1000)
+    print(f"{'exact':>8} {'recall':>8} {'p50 ms':>10} {'p99 ms':>10}")
+    print(f"{'-':>8} {1.0:>8.3f} {np.percentile(exact_ms, 50):>10.3f} {np.percentile(exact_ms, 99):>10.3f}")
+
+    print(f"{'nprobe':>8} {'recall':>8} {'p50 ms':>10} {'p99 ms':>10}")
+    for nprobe in args.nprobe:
+        hits = 0
+        samples = []
+        for q, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found = ivf.search(q, args.top_k, nprobe=nprobe)
+            samples.append((time.perf_counter() - start) * 1000)
+            hits += len(expected & {i for i, _ in found})
+        recall = hits / (len(queries) * args.top_k)
+        print(f"{nprobe:>8} {recall:>8.3f} {np.percentile(samples, 50):>10.3f} "
+              f"{np.percentile(samples, 99):>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
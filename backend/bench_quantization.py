@@ -0,0 +1,76 @@
+"""
+Memory and recall@k of quantized embedding codes against exact float32 search.
+Uses synthetic clustered embeddings, so no Gemini API key is needed.
+
+Usage: python bench_quantization.py [--docs 100000] [--dim 768] [--rerank 1 4 16 32]
+"""
+
+import argparse
+import time
+import numpy as np
+from vector_index import VectorIndex
+from quantized_index import QuantizedIndex, KINDS
+from bench_ivf_recall import synthetic_corpus
+
+PYTHON_FLOAT_BYTES = 32  # 8-byte list slot + 24-byte float object
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--topics', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS))
+    parser.add_argument('--rerank', type=int, nargs='+', default=[1, 4, 16, 32],
+                        help="Shortlist sizes as multiples of top_k (1 = codes only, no re-rank)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors, centers = synthetic_corpus(rng, args.docs, args.dim, args.topics)
+    exact = VectorIndex(vectors, np.arange(args.docs))
+    del vectors
+
+    query_topics = rng.integers(0, args.topics, size=(args.queries, 2))
+    queries = (centers[query_topics].sum(axis=1)
+               + rng.standard_normal((args.queries, args.dim)).astype(np.float32))
+
+    truth = []
+    exact_ms = []
+    for q in queries:
+        start = time.perf_counter()
+        truth.append({i for i, _ in exact.search(q, args.top_k)})
+        exact_ms.append((time.perf_counter() - start) * 1000)
+
+    float32_bytes = args.dim * 4
+    print(f"docs={args.docs} dim={args.dim} top_k={args.top_k} "
+          f"python-list bytes/doc={args.dim * PYTHON_FLOAT_BYTES + 56}")
+    print(f"{'codes':>8} {'rerank':>7} {'bytes/doc':>10} {'vs f32':>7} {'vs list':>8} "
+          f"{'recall':>7} {'p50 ms':>9} {'p99 ms':>9}")
+    print(f"{'float32':>8} {'-':>7} {float32_bytes:>10} {1.0:>7.1f} "
+          f"{(args.dim * PYTHON_FLOAT_BYTES + 56) / float32_bytes:>8.1f} {1.0:>7.3f} "
+          f"{np.percentile(exact_ms, 50):>9.3f} {np.percentile(exact_ms, 99):>9.3f}")
+
+    for kind in args.kinds:
+        start = time.perf_counter()
+        index = QuantizedIndex(exact, kind)
+        build_s = time.perf_counter() - start
+        per_doc = index.nbytes / args.docs
+        for rerank in args.rerank:
+            hits = 0
+            samples = []
+            for q, expected in zip(queries, truth):
+                start = time.perf_counter()
+                found = index.search(q, args.top_k, rerank=rerank)
+                samples.append((time.perf_counter() - start) * 1000)
+                hits += len(expected & {i for i, _ in found})
+            recall = hits / (len(queries) * args.top_k)
+            print(f"{kind:>8} {rerank:>7} {per_doc:>10.1f} {float32_bytes / per_doc:>7.1f} "
+                  f"{(args.dim * PYTHON_FLOAT_BYTES + 56) / per_doc:>8.1f} {recall:>7.3f} "
+                  f"{np.percentile(samples, 50):>9.3f} {np.percentile(samples, 99):>9.3f}")
+        print(f"{'':>8} (built {kind} codes in {build_s:.2f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,396 @@
+"""
+Offline benchmark suite: search, /chat, /login, ingestion and startup with a fake Gemini.
+
+Everything runs in-process against synthetic knowledge bases, with Gemini
+replaced by fake_genai.FakeGenAI (deterministic, configurable latency), so
+no API key or server is needed. Results are written as JSON (--output) and
+summarized on stdout; pass --baseline to compare against an earlier run and
+exit non-zero when a metric regresses by more than --tolerance.
+
+The startup scenario times fresh interpreter processes (import app,
+create_app(), first /health/live answer, warm-up finished) against the real
+knowledge base in this directory.
+
+Usage:
+    python bench_suite.py [--scenarios search chat login ingest startup] [--sizes 1000 10000]
+                          [--output bench_results.json] [--baseline old.json --tolerance 0.25]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# The app reads these at import time; keep the benchmark away from real data
+_tmp = tempfile.mkdtemp(prefix="bench-suite-")
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+os.environ.setdefault("DB_NAME", os.path.join(_tmp, "users.db"))
+os.environ.setdefault("SESSION_STORE", "memory")
+os.environ["RELOAD_POLL_SECONDS"] = "0"
+# Measure the app, not the production Gemini rate limit; keep its state file out of the source tree
+os.environ["UPSTREAM_MAX_CONCURRENT"] = "0"
+os.environ.setdefault("UPSTREAM_DB", os.path.join(_tmp, "upstream_limits.db"))
+
+import app as chatbot
+from fake_genai import FakeGenAI
+from vector_index import VectorIndex
+from bm25_index import BM25Index
+from index_snapshot import IndexSnapshot
+from chunking import chunk_document
+from embedding_pipeline import FakeEmbeddingClient, sync_embeddings, document_text, fake_embedding
+
+SCENARIOS = ("search", "chat", "login", "ingest", "startup")
+
+# Run in a fresh interpreter by bench_startup; prints one "STARTUP {json}" line of timings in seconds
+STARTUP_PROBE = """
+import sys, json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+status = flask_app.test_client().get('/health/live').status_code
+live = time.perf_counter()
+app.ready.wait(120)
+ready = time.perf_counter()
+sys.stdout.write("STARTUP " + json.dumps({"import": imported - start, "create_app": created - imported,
+                                          "live": live - start, "ready": ready - start, "status": status}) + "\\n")
+"""
+
+# Lower is better for these suffixes; higher is better for the rest that are compared
+LOWER_IS_BETTER = ("_ms",)
+HIGHER_IS_BETTER = ("_per_s",)
+
+WORDS = (
+    "foundation concrete slab beam column roof tile brick plaster plumbing wiring "
+    "renovation kitchen bathroom villa apartment office warehouse permit estimate "
+    "quote budget timeline engineer architect site survey soil load steel cement "
+    "waterproofing flooring paint window door staircase elevation design approval "
+    "chennai coimbatore madurai residential commercial structural inspection warranty"
+).split()
+
+
+def synthetic_docs(n, seed=0, words_per_doc=120):
+    """n deterministic knowledge-base records with a skewed (Zipf-like) vocabulary."""
+    rng = np.random.default_rng(seed)
+    vocab = WORDS + [f"term{i}" for i in range(2000)]
+    weights = 1.0 / np.arange(1, len(vocab) + 1)
+    weights /= weights.sum()
+    docs = []
+    for i in range(n):
+        tokens = rng.choice(len(vocab), size=words_per_doc, p=weights)
+        docs.append({
+            "id": f"page{i // 4}.html#{i % 4}",
+            "source": f"page{i // 4}.html",
+            "title": f"Page {i // 4}",
+            "section": f"Section {i % 4}",
+            "description": "",
+            "content": " ".join(vocab[t] for t in tokens) + ".",
+        })
+    return docs
+
+
+def synthetic_queries(n, seed=1):
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(WORDS, size=4)) + f" q{i}" for i in range(n)]
+
+
+def build_snapshot(docs, dim):
+    vectors = np.array([fake_embedding(document_text(doc), dim) for doc in docs], dtype=np.float32)
+    return IndexSnapshot(
+        docs, BM25Index.build(document_text(doc) for doc in docs),
+        VectorIndex(vectors, np.arange(len(docs))),
+    )
+
+
+def summarize(latencies, wall=None):
+    ms = np.array(latencies) * 1000
+    summary = {
+        "count": len(latencies),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+    }
+    if wall:
+        summary["requests_per_s"] = round(len(latencies) / wall, 2)
+    return summary
+
+
+def timed(fn, items):
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_search(args, fake, results):
+    # Query embeddings are computed up front so only scoring is timed
+    queries = [(q, fake_embedding(q, args.dim)) for q in synthetic_queries(args.queries)]
+    top_k = chatbot.RETRIEVAL_TOP_K
+    mode = chatbot.SEARCH_MODE
+    for size in args.sizes:
+        chatbot.snapshot = build_snapshot(synthetic_docs(size), args.dim)
+        cases = (
+            ("semantic_search", "vector", lambda q: chatbot.semantic_search(q[0], top_k, query_embedding=q[1])),
+            ("semantic_search", "hybrid", lambda q: chatbot.semantic_search(q[0], top_k, query_embedding=q[1])),
+            ("keyword_search", "bm25", lambda q: chatbot.keyword_search(q[0], top_k)),
+        )
+        for name, case_mode, fn in cases:
+            chatbot.SEARCH_MODE = case_mode
+            timed(fn, queries[:10])  # warm up
+            results.append({
+                "scenario": name,
+                "params": {"documents": size, "mode": case_mode, "dim": args.dim},
+                "metrics": summarize(timed(fn, queries)),
+            })
+    chatbot.SEARCH_MODE = mode
+
+
+def bench_chat(args, fake, results):
+    fake.embed_latency = args.embed_latency
+    fake.gen_latency = args.gen_latency
+    chatbot.snapshot = build_snapshot(synthetic_docs(args.chat_docs), args.dim)
+    client = chatbot.app.test_client()
+
+    for repeated in (False, True):
+        for threads in args.threads:
+            chatbot.query_embedding_cache.clear()
+            chatbot.answer_cache.clear()
+            chatbot.semantic_cache.clear()
+            before = fake.stats()
+            run_id = f"bench-{'repeated' if repeated else 'unique'}-{threads}"  # fresh sessions, no history
+            messages = (["How much does a foundation cost?"] * args.requests if repeated
+                        else synthetic_queries(args.requests, seed=threads))
+
+            def one(i):
+                start = time.perf_counter()
+                response = client.post('/chat', json={"message": messages[i], "session_id": f"{run_id}-{i}"})
+                return time.perf_counter() - start, response.status_code
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                outcomes = list(pool.map(one, range(args.requests)))
+            wall = time.perf_counter() - start
+            after = fake.stats()
+
+            metrics = summarize([o[0] for o in outcomes], wall)
+            metrics["errors"] = sum(1 for o in outcomes if o[1] != 200)
+            metrics["upstream_embed_calls"] = after["embed_calls"] - before["embed_calls"]
+            metrics["upstream_generate_calls"] = after["generate_calls"] - before["generate_calls"]
+            results.append({
+                "scenario": "chat",
+                "params": {"threads": threads, "requests": args.requests, "repeated_question": repeated,
+                           "documents": args.chat_docs, "embed_latency": args.embed_latency,
+                           "gen_latency": args.gen_latency},
+                "metrics": metrics,
+            })
+
+
+def bench_login(args, fake, results):
+    client = chatbot.app.test_client()
+    users = [f"bench{i}@example.com" for i in range(args.users)]
+    register = []
+    for email in users:
+        start = time.perf_counter()
+        client.post('/register', json={"email": email, "password": "correct horse"})
+        register.append(time.perf_counter() - start)
+    results.append({"scenario": "register", "params": {"users": args.users},
+                    "metrics": summarize(register, sum(register))})
+
+    for threads in args.threads:
+        def one(i):
+            start = time.perf_counter()
+            response = client.post('/login', json={"email": users[i % len(users)], "password": "correct horse"})
+            return time.perf_counter() - start, response.status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            outcomes = list(pool.map(one, range(args.users)))
+        wall = time.perf_counter() - start
+        metrics = summarize([o[0] for o in outcomes], wall)
+        metrics["busy_503"] = sum(1 for o in outcomes if o[1] == 503)
+        metrics["errors"] = sum(1 for o in outcomes if o[1] not in (200, 503))
+        results.append({"scenario": "login", "params": {"threads": threads, "users": args.users,
+                                                         "hash_method": chatbot.password_hasher.method},
+                        "metrics": metrics})
+
+
+def bench_ingest(args, fake, results):
+    pages = synthetic_docs(args.ingest_pages, seed=2, words_per_doc=900)
+    for page in pages:
+        page.pop("section")
+        page.pop("id")
+    client = FakeEmbeddingClient(dim=args.dim, latency=args.embed_latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        npy_path = os.path.join(tmp, "embeddings.npy")
+
+        start = time.perf_counter()
+        chunks = [chunk for page in pages for chunk in chunk_document(page)]
+        chunk_time = time.perf_counter() - start
+
+        runs = [("full", chunks)]
+        edited = [dict(c, content=c["content"] + " updated") if i % 10 == 0 else c
+                  for i, c in enumerate(chunks)]
+        runs.append(("incremental_10pct", edited))
+        for name, docs in runs:
+            requests_before = client.requests
+            start = time.perf_counter()
+            stats = sync_embeddings(docs, npy_path, client, chatbot.EMBEDDING_MODEL)
+            wall = time.perf_counter() - start
+            results.append({
+                "scenario": "ingest",
+                "params": {"run": name, "pages": len(pages), "chunks": len(docs),
+                           "embed_latency": args.embed_latency, "dim": args.dim},
+                "metrics": {
+                    "chunking_ms": round(chunk_time * 1000, 3) if name == "full" else 0.0,
+                    "sync_ms": round(wall * 1000, 3),
+                    "chunks_per_s": round(len(docs) / wall, 2),
+                    "embedded": stats["embedded"],
+                    "reused": stats["reused"],
+                    "embed_requests": client.requests - requests_before,
+                },
+            })
+
+
+def bench_startup(args, fake, results):
+    samples = []
+    for _ in range(args.startup_runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-c", STARTUP_PROBE], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+        wall = time.perf_counter() - start
+        if proc.returncode != 0:
+            print(proc.stderr)
+            raise RuntimeError("startup probe failed")
+        timings = json.loads(re.search(r"STARTUP (\{.*?\})", proc.stdout).group(1))
+        timings["process"] = wall
+        samples.append(timings)
+
+    def median_ms(field):
+        return round(float(np.median([t[field] for t in samples])) * 1000, 3)
+
+    results.append({
+        "scenario": "startup",
+        "params": {"runs": args.startup_runs},
+        "metrics": {
+            "import_ms": median_ms("import"),
+            "create_app_ms": median_ms("create_app"),
+            "live_ms": median_ms("live"),
+            "ready_ms": median_ms("ready"),
+            "process_ms": median_ms("process"),
+            "errors": sum(1 for t in samples if t["status"] != 200),
+        },
+    })
+
+
+def print_summary(results):
+    print(f"{'scenario':<16} {'params':<60} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+    for result in results:
+        metrics = result["metrics"]
+        params = " ".join(f"{k}={v}" for k, v in result["params"].items()
+                          if k not in ("dim", "embed_latency", "gen_latency"))
+        rate = metrics.get("requests_per_s", metrics.get("chunks_per_s", ""))
+        p50 = metrics.get('p50_ms', metrics.get('sync_ms', metrics.get('ready_ms', '')))
+        print(f"{result['scenario']:<16} {params:<60} {p50:>9} "
+              f"{metrics.get('p99_ms', ''):>9} {rate:>8}")
+
+
+def result_key(result):
+    return result["scenario"] + json.dumps(result["params"], sort_keys=True)
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of human-readable regressions against a baseline run."""
+    previous = {result_key(r): r["metrics"] for r in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        for name, value in result["metrics"].items():
+            before = old.get(name)
+            if not before:
+                continue
+            if name.endswith(LOWER_IS_BETTER) and value > before * (1 + tolerance):
+                regressions.append(f"{result['scenario']} {result['params']}: {name} {before} -> {value}")
+            elif name.endswith(HIGHER_IS_BETTER) and value < before * (1 - tolerance):
+                regressions.append(f"{result['scenario']} {result['params']}: {name} {before} -> {value}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help="Knowledge-base sizes for the search scenario")
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--chat-docs', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=100, help="/chat requests per run")
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--ingest-pages', type=int, default=100)
+    parser.add_argument('--startup-runs', type=int, default=5, help="Fresh processes timed by the startup scenario")
+    parser.add_argument('--embed-latency', type=float, default=0.05)
+    parser.add_argument('--gen-latency', type=float, default=0.3)
+    parser.add_argument('--output', default="bench_results.json", help="JSON results file")
+    parser.add_argument('--baseline', help="Earlier results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Allowed relative slowdown before a metric counts as a regression")
+    args = parser.parse_args()
+
+    chatbot.create_app(background=False)
+    fake = FakeGenAI(embed_latency=args.embed_latency, gen_latency=args.gen_latency, dim=args.dim).install(chatbot)
+    results = []
+    for scenario in args.scenarios:
+        print(f"Running {scenario}...")
+        globals()[f"bench_{scenario}"](args, fake, results)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+    print_summary(results)
+    print(f"DONE: Wrote {len(results)} results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION: {line}")
+        if regressions:
+            sys.exit(1)
+        print("DONE: No regressions against baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Latency benchmark for the in-memory vector index used by semantic_search.
+Uses random embeddings, so no Gemini API key is needed.
+
+Usage: python bench_vector_index.py [--dim 768] [--queries 200] [--sizes 1000 10000 100000]
+"""
+
+import argparse
+import time
+import numpy as np
+from vector_index import VectorIndex
+
+
+def legacy_search(records, query_embedding, top_k=3):
+    """Per-document scoring loop, as semantic_search did before VectorIndex."""
+    query = np.asarray(query_embedding)
+    similarities = []
+    for doc_emb in records:
+        emb = np.asarray(doc_emb['embedding'])
+        similarity = float(query @ emb / (np.linalg.norm(query) * np.linalg.norm(emb)))
+        similarities.append({'index': doc_emb['index'], 'similarity': similarity})
+    similarities.sort(key=lambda x: x['similarity'], reverse=True)
+    return similarities[:top_k]
+
+
+def percentiles(samples_ms):
+    return np.percentile(samples_ms, 50), np.percentile(samples_ms, 99)
+
+
+def time_queries(search, queries):
+    samples = []
+    for q in queries:
+        start = time.perf_counter()
+        search(q)
+        samples.append((time.perf_counter() - start) * 1000)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--legacy-max', type=int, default=10000,
+                        help="Skip the legacy loop above this corpus size")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    print(f"dim={args.dim} queries={args.queries} top_k={args.top_k}")
+    print(f"{'docs':>8} {'impl':>8} {'p50 ms':>10} {'p99 ms':>10}")
+    for n in args.sizes:
+        vectors = rng.standard_normal((n, args.dim)).astype(np.float32)
+        index = VectorIndex(vectors, np.arange(n))
+
+        p50, p99 = time_queries(lambda q: index.search(q, args.top_k), queries)
+        print(f"{n:>8} {'index':>8} {p50:>10.3f} {p99:>10.3f}")
+
+        if n <= args.legacy_max:
+            records = [{'index': i, 'embedding': v.tolist()} for i, v in enumerate(vectors)]
+            legacy_queries = queries[:max(1, args.queries // 10)]
+            p50, p99 = time_queries(lambda q: legacy_search(records, q, args.top_k), legacy_queries)
+            print(f"{n:>8} {'legacy':>8} {p50:>10.3f} {p99:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
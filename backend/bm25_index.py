@@ -0,0 +1,156 @@
+"""
+BM25 keyword index over the knowledge base.
+
+Postings are stored as flat arrays (term -> slice of doc ids and weights).
+Each posting's weight is its full BM25 contribution (idf x saturated tf with
+length normalization), precomputed at build time, so a query only gathers
+and sums the postings of its terms; cost depends on those postings, not on
+corpus size.
+"""
+
+import os
+import re
+import math
+import hashlib
+from collections import Counter
+import numpy as np
+
+K1 = 1.5
+B = 0.75
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+    a an and are as at be but by do does for from has have how i in is it its of on or our
+    that the their this to was we what when where which who why will with you your
+""".split())
+
+
+def tokenize(text):
+    return [t for t in _TOKEN.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def bm25_path_for(knowledge_base_path):
+    """Index file stored next to the knowledge base, e.g. knowledge_base.jsonl -> knowledge_base.bm25.npz."""
+    root, _ = os.path.splitext(knowledge_base_path)
+    return root + ".bm25.npz"
+
+
+def corpus_fingerprint(texts):
+    """Identifies the corpus an index was built from (must match BM25Index.build)."""
+    h = hashlib.sha1()
+    for text in texts:
+        h.update(text.encode('utf-8'))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class BM25Index:
+    """Inverted index with precomputed BM25 posting weights."""
+
+    def __init__(self, terms, offsets, doc_ids, weights, num_docs, source=None):
+        self.terms = {term: i for i, term in enumerate(terms)}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.num_docs = num_docs
+        self.source = source
+
+    @classmethod
+    def build(cls, texts, k1=K1, b=B):
+        """Index document texts (doc id = position); texts may be a one-pass generator."""
+        postings = {}
+        lengths = []
+        fingerprint = hashlib.sha1()
+        for doc_id, text in enumerate(texts):
+            fingerprint.update(text.encode('utf-8'))
+            fingerprint.update(b"\0")
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        doc_lengths = np.array(lengths, dtype=np.float32)
+        n = len(lengths)
+        avgdl = float(doc_lengths.mean()) if n and doc_lengths.sum() else 1.0
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        doc_ids = []
+        weights = []
+        for i, term in enumerate(terms):
+            plist = postings[term]
+            idf = math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            ids = np.array([d for d, _ in plist], dtype=np.int32)
+            tf = np.array([t for _, t in plist], dtype=np.float32)
+            norm = k1 * (1 - b + b * doc_lengths[ids] / avgdl)
+            doc_ids.append(ids)
+            weights.append(idf * tf * (k1 + 1) / (tf + norm))
+            offsets[i + 1] = offsets[i] + len(plist)
+
+        return cls(
+            terms, offsets,
+            np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype=np.int32),
+            np.concatenate(weights) if weights else np.zeros(0, dtype=np.float32),
+            n, source=fingerprint.hexdigest(),
+        )
+
+    @classmethod
+    def load(cls, path, expected_source=None):
+        """Load a saved index; returns None if it was built from a different corpus."""
+        with np.load(path) as data:
+            source = str(data['source'])
+            if expected_source is not None and source != expected_source:
+                return None
+            return cls(data['terms'].tolist(), data['offsets'], data['doc_ids'],
+                       data['weights'], int(data['num_docs']), source=source)
+
+    def save(self, path):
+        terms = sorted(self.terms, key=self.terms.get)
+        tmp_path = f"{path}.tmp.{os.getpid()}.npz"
+        np.savez(tmp_path, terms=np.array(terms, dtype=str), offsets=self.offsets,
+                 doc_ids=self.doc_ids, weights=self.weights,
+                 num_docs=np.array(self.num_docs), source=np.array(self.source))
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return self.num_docs
+
+    def search(self, query, top_k=3, allowed=None):
+        """Return [(doc_index, score), ...] for the top_k BM25 matches (score > 0).
+
+        allowed (a boolean mask over doc ids) drops postings of other documents
+        before scoring.
+        """
+        slices = []
+        for term in tokenize(query):
+            i = self.terms.get(term)
+            if i is not None:
+                slices.append(slice(self.offsets[i], self.offsets[i + 1]))
+        if not slices or top_k <= 0:
+            return []
+
+        ids = np.concatenate([self.doc_ids[s] for s in slices])
+        contributions = np.concatenate([self.weights[s] for s in slices])
+        if allowed is not None:
+            keep = allowed[ids]
+            ids, contributions = ids[keep], contributions[keep]
+            if ids.size == 0:
+                return []
+        docs, inverse = np.unique(ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions)
+
+        top_k = min(top_k, len(docs))
+        if top_k < len(docs):
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            candidates = np.arange(len(docs))
+        order = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(int(docs[i]), float(scores[i])) for i in order]
+
+
+def reciprocal_rank_fusion(rankings, top_k, k=60):
+    """Fuse ranked lists of doc indices: score(d) = sum over lists of 1 / (k + rank)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_index in enumerate(ranking):
+            scores[doc_index] = scores.get(doc_index, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda d: scores[d], reverse=True)[:top_k]
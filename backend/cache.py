@@ -0,0 +1,291 @@
+"""
+Bounded in-process caches for the chatbot (query embeddings, answers, and
+answers looked up by query similarity), and single-flight wrappers that let
+concurrent identical requests share one upstream call while the cache is
+still cold.
+"""
+
+import re
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+import numpy as np
+
+_MISSING = object()
+
+
+def normalize_query(text):
+    """Cache key form of a user message: lowercase, single spaces, no trailing punctuation."""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip("?!. ")
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss counters.
+
+    max_entries bounds the entry count; ttl (seconds) of None or 0 never expires.
+    """
+
+    def __init__(self, max_entries=1024, ttl=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= self._clock():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        expires_at = self._clock() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def values(self):
+        """Snapshot of the cached values (expired entries included until next lookup)."""
+        with self._lock:
+            return [value for value, _ in self._data.values()]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class SemanticCache:
+    """Answers looked up by query-embedding similarity rather than exact text.
+
+    get() returns the answer stored for the most similar earlier query whose
+    cosine similarity is at least `threshold` and that was answered from the
+    same retrieved sources and scope (e.g. the retrieval filter, so answers
+    never cross user roles); anything else is a miss. Embeddings are kept
+    normalized in one preallocated (max_entries x dim) matrix, so a lookup is
+    a single matrix-vector product. Least recently used entries are evicted
+    first; ttl works as in LRUCache. clear() is the invalidation hook.
+    """
+
+    def __init__(self, max_entries=256, threshold=0.92, ttl=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self._clock = clock
+        self._vectors = None  # allocated on the first set(), once the dimension is known
+        self._entries = OrderedDict()  # row -> (sources, scope, value, expires_at), in LRU order
+        self._free = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.near_misses = 0  # similar enough, but retrieved different sources
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def get(self, embedding, sources, scope=None):
+        query = self._unit(embedding)
+        sources = frozenset(sources)
+        with self._lock:
+            if (query is None or not self._entries
+                    or query.shape[0] != self._vectors.shape[1]):
+                self.misses += 1
+                return None
+            rows = np.fromiter(self._entries, dtype=np.intp, count=len(self._entries))
+            scores = (self._vectors @ query)[rows]
+            now = self._clock()
+            near = False
+            for i in np.argsort(-scores):
+                if scores[i] < self.threshold:
+                    break
+                row = int(rows[i])
+                entry_sources, entry_scope, value, expires_at = self._entries[row]
+                if expires_at is not None and expires_at <= now:
+                    del self._entries[row]
+                    self._free.append(row)
+                    self.expirations += 1
+                    continue
+                if entry_scope != scope:
+                    continue
+                if entry_sources != sources:
+                    near = True
+                    continue
+                self._entries.move_to_end(row)
+                self.hits += 1
+                return value
+            self.near_misses += near
+            self.misses += 1
+            return None
+
+    def set(self, embedding, sources, value, scope=None):
+        if self.max_entries <= 0:
+            return
+        vector = self._unit(embedding)
+        if vector is None:
+            return
+        expires_at = self._clock() + self.ttl if self.ttl else None
+        with self._lock:
+            if (self._vectors is None or self._vectors.shape != (self.max_entries, vector.shape[0])):
+                # First entry, or the embedding model or size changed: start over
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                self._entries.clear()
+                self._free = list(range(self.max_entries - 1, -1, -1))
+            if self._free:
+                row = self._free.pop()
+            else:
+                row, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+            self._vectors[row] = vector
+            self._entries[row] = (frozenset(sources), scope, value, expires_at)
+
+    def clear(self):
+        with self._lock:
+            self._free.extend(self._entries)
+            self._entries.clear()
+            self.invalidations += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "near_misses": self.near_misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one (threaded callers).
+
+    The first caller for a key runs fn; callers that arrive while it is in
+    flight wait and get the same result or exception. Nothing is kept after
+    the call returns; pair it with a cache for that.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """Return (result, shared); shared is True if another caller's call was reused."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._calls)}
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop.
+
+    The upstream call runs as its own task, so a caller that disconnects does
+    not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, coro_fn):
+        """Return (result, shared) like SingleFlight.do."""
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.shared += 1
+        else:
+            task = self._tasks[key] = asyncio.ensure_future(coro_fn())
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+            self.calls += 1
+        return await asyncio.shield(task), shared
+
+    def stats(self):
+        return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._tasks)}
@@ -0,0 +1,118 @@
+"""
+Split page text into retrieval chunks.
+
+Text is cut into sentence windows that fit a token budget, with a few
+sentences of overlap between neighbouring chunks. Offsets are character
+positions in the text that was passed in.
+"""
+
+import os
+import re
+
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "headings")  # headings | sentences | none
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "250"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_WORD = re.compile(r"\S+")
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for English text)."""
+    return max(1, (len(text) + 3) // 4) if text else 0
+
+
+def _sentence_spans(text, max_tokens):
+    """(start, end) spans of sentences; sentences over max_tokens are split at words."""
+    spans = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        spans.append((start, match.start()))
+        start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+
+    units = []
+    for start, end in spans:
+        if estimate_tokens(text[start:end]) <= max_tokens:
+            units.append((start, end))
+            continue
+        piece_start = None
+        for word in _WORD.finditer(text, start, end):
+            if piece_start is None:
+                piece_start = word.start()
+            elif estimate_tokens(text[piece_start:word.end()]) > max_tokens:
+                units.append((piece_start, prev_end))
+                piece_start = word.start()
+            prev_end = word.end()
+        if piece_start is not None:
+            units.append((piece_start, prev_end))
+    return units
+
+
+def chunk_spans(text, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Pack sentences into windows of at most max_tokens; returns [(start, end), ...]."""
+    units = _sentence_spans(text, max_tokens)
+    chunks = []
+    first = 0
+    while first < len(units):
+        last = first
+        while (last + 1 < len(units)
+               and estimate_tokens(text[units[first][0]:units[last + 1][1]]) <= max_tokens):
+            last += 1
+        chunks.append((units[first][0], units[last][1]))
+        if last + 1 >= len(units):
+            break
+
+        # Start the next window a few sentences back, as long as the overlap
+        # stays within overlap_tokens and still leaves room for the next sentence
+        following_end = units[last + 1][1]
+        next_first = last + 1
+        while next_first - 1 > first:
+            overlap_start = units[next_first - 1][0]
+            if (estimate_tokens(text[overlap_start:units[last][1]]) > overlap_tokens
+                    or estimate_tokens(text[overlap_start:following_end]) > max_tokens):
+                break
+            next_first -= 1
+        first = next_first
+    return chunks
+
+
+def chunk_document(doc, sections=None, strategy=CHUNK_STRATEGY,
+                   max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Split a knowledge-base document into chunk records.
+
+    sections is an optional [(heading, start, end), ...] list of spans in
+    doc['content']; the "headings" strategy keeps chunks inside one section.
+    Each chunk keeps the document fields and adds id, chunk, section, offset
+    and length.
+    """
+    content = doc['content']
+    if strategy == "none":
+        spans = [("", 0, len(content))]
+    elif strategy == "headings" and sections:
+        spans = [
+            (heading, start + s, start + e)
+            for heading, start, end in sections
+            for s, e in chunk_spans(content[start:end], max_tokens, overlap_tokens)
+        ]
+    else:
+        spans = [("", s, e) for s, e in chunk_spans(content, max_tokens, overlap_tokens)]
+
+    chunks = []
+    for heading, start, end in spans:
+        raw = content[start:end]
+        text = raw.strip()
+        if not text:
+            continue
+        start += len(raw) - len(raw.lstrip())
+        chunks.append({
+            **doc,
+            "id": f"{doc['source']}#{len(chunks)}",
+            "chunk": len(chunks),
+            "section": heading,
+            "offset": start,
+            "length": len(text),
+            "content": text,
+        })
+    return chunks
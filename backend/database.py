@@ -0,0 +1,99 @@
+"""
+SQLite access for the user/auth tables.
+
+Each thread reuses one connection, opened in WAL mode with tuned pragmas,
+so readers never block the writer and concurrent registrations wait on
+busy_timeout instead of failing with "database is locked". Queries are
+fixed SQL strings, so sqlite3's per-connection statement cache keeps them
+prepared.
+
+Index strategy for `users`: every lookup is by email, and the UNIQUE
+constraint's automatic index (sqlite_autoindex_users_1) already serves
+login/profile lookups and duplicate detection on register. No secondary
+indexes are added, keeping inserts to one table and one index b-tree; a
+covering (email, role) index was tried and the planner still prefers the
+unique index.
+"""
+
+import os
+import sqlite3
+import threading
+
+DB_NAME = os.getenv("DB_NAME", "users.db")
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",     # durable at checkpoints; safe with WAL
+    "busy_timeout": "5000",      # ms to wait for the write lock
+    "mmap_size": str(64 * 1024 * 1024),
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+}
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        role TEXT DEFAULT 'client',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+INSERT_USER = "INSERT INTO users (email, password, role) VALUES (?, ?, ?)"
+SELECT_LOGIN = "SELECT id, email, password, role FROM users WHERE email = ?"
+SELECT_PROFILE = "SELECT id, email, role FROM users WHERE email = ?"
+
+
+class Database:
+    """Thread-local pooled connections to one SQLite file."""
+
+    def __init__(self, path=DB_NAME):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=5,
+                isolation_level=None,      # explicit transactions only
+                cached_statements=128,
+            )
+            for name, value in PRAGMAS.items():
+                conn.execute(f"PRAGMA {name}={value}")
+            self._local.conn = conn
+        return conn
+
+    def init_schema(self):
+        conn = self.connection()
+        conn.execute(SCHEMA)
+        # Simple migration for existing DB
+        try:
+            conn.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'client'")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        conn.execute("PRAGMA optimize")
+        print("DONE: Database initialized")
+
+    def create_user(self, email, password_hash, role):
+        """Insert a user; raises sqlite3.IntegrityError if the email exists."""
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(INSERT_USER, (email, password_hash, role))
+
+    def get_login_user(self, email):
+        """(id, email, password_hash, role) or None."""
+        return self.connection().execute(SELECT_LOGIN, (email,)).fetchone()
+
+    def get_profile(self, email):
+        """(id, email, role) or None."""
+        return self.connection().execute(SELECT_PROFILE, (email,)).fetchone()
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
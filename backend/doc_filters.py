@@ -0,0 +1,187 @@
+"""
+Metadata filters for retrieval.
+
+Every knowledge-base record has a source, a page type and an audience: the
+user roles (users.role: "client" or "builder") a page is meant for, or
+"all". ingest_data.py stamps page_type and audience on each record; records
+from older knowledge bases get them from the source with the same rules.
+
+FilterIndex is built once per index snapshot. It keeps the sorted document
+positions of every source, page type and audience, so a filtered query
+combines a few integer arrays and then scores only those rows, instead of
+searching everything and post-filtering the top-k.
+"""
+
+import os
+import threading
+import numpy as np
+
+ROLES = ("client", "builder")
+EVERYONE = "all"
+DEFAULT_PAGE_TYPE = "content"
+
+# page_type and audience for pages that are not general content
+PAGE_METADATA = {
+    "client_dash.html": {"page_type": "dashboard", "audience": ["client"]},
+    "dash.html": {"page_type": "dashboard", "audience": ["builder"]},
+    "login.html": {"page_type": "auth", "audience": [EVERYONE]},
+    "register.html": {"page_type": "auth", "audience": [EVERYONE]},
+    "community.html": {"page_type": "community", "audience": [EVERYONE]},
+}
+
+# Page types left out of chat retrieval unless a request asks for them by page_type
+DEFAULT_EXCLUDED_PAGE_TYPES = tuple(
+    t.strip() for t in os.getenv("RETRIEVAL_EXCLUDE_PAGE_TYPES", "auth").split(",") if t.strip()
+)
+
+SELECTION_CACHE_SIZE = 256
+
+
+def page_metadata(source):
+    """{"page_type": ..., "audience": [...]} for a page, as ingest_data.py records it."""
+    name = os.path.basename(source)
+    meta = PAGE_METADATA.get(source) or PAGE_METADATA.get(name)
+    if meta is None:
+        return {"page_type": DEFAULT_PAGE_TYPE, "audience": [EVERYONE]}
+    return {"page_type": meta["page_type"], "audience": list(meta["audience"])}
+
+
+def _as_values(value, field):
+    if value is None:
+        return frozenset()
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, (list, tuple)) or not all(isinstance(v, str) for v in value):
+        raise ValueError(f"'{field}' must be a string or a list of strings")
+    return frozenset(value)
+
+
+class RetrievalFilter:
+    """Which documents a query may retrieve.
+
+    sources / page_types keep only matching documents (any of the values);
+    exclude_page_types drops page types; role limits results to pages whose
+    audience is everyone or that role. role=None is an anonymous user.
+    """
+
+    def __init__(self, sources=(), page_types=(), exclude_page_types=DEFAULT_EXCLUDED_PAGE_TYPES, role=None):
+        self.sources = frozenset(sources)
+        self.page_types = frozenset(page_types)
+        # Asking for a page type explicitly overrides the default exclusions
+        self.exclude_page_types = frozenset(exclude_page_types) - self.page_types
+        self.role = role
+
+    @classmethod
+    def from_request(cls, spec, role=None):
+        """Build from a request's {"source": ..., "page_type": ..., "exclude_page_type": ...}.
+
+        Raises ValueError for a malformed spec.
+        """
+        spec = spec or {}
+        if not isinstance(spec, dict):
+            raise ValueError("'filters' must be an object")
+        unknown = set(spec) - {"source", "page_type", "exclude_page_type"}
+        if unknown:
+            raise ValueError(f"Unknown filter(s): {', '.join(sorted(unknown))}")
+        exclude = _as_values(spec.get("exclude_page_type"), "exclude_page_type")
+        return cls(
+            sources=_as_values(spec.get("source"), "source"),
+            page_types=_as_values(spec.get("page_type"), "page_type"),
+            exclude_page_types=exclude | frozenset(DEFAULT_EXCLUDED_PAGE_TYPES),
+            role=role,
+        )
+
+    def key(self):
+        return (tuple(sorted(self.sources)), tuple(sorted(self.page_types)),
+                tuple(sorted(self.exclude_page_types)), self.role)
+
+
+class Selection:
+    """Documents a filter allows: sorted knowledge-base positions and vector rows.
+
+    excluded_rows is the complement of rows. Most filters drop only a few
+    pages, and searchers score such a subset with one full product, masking
+    the excluded rows.
+    """
+
+    def __init__(self, positions, rows, num_docs, num_rows):
+        self.positions = positions
+        self.rows = rows
+        self.mask = np.zeros(num_docs, dtype=bool)  # by position, for BM25 postings
+        self.mask[positions] = True
+        row_mask = np.ones(num_rows, dtype=bool)
+        row_mask[rows] = False
+        self.excluded_rows = np.flatnonzero(row_mask)
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class FilterIndex:
+    """Per-snapshot partitions of the knowledge base by source, page type and audience."""
+
+    def __init__(self, knowledge_base, vector_ids):
+        self.num_docs = len(knowledge_base)
+        partitions = {"source": {}, "page_type": {}, "audience": {}}
+        for position, doc in enumerate(knowledge_base):
+            meta = page_metadata(doc.get("source", ""))
+            page_type = doc.get("page_type") or meta["page_type"]
+            audience = doc.get("audience") or meta["audience"]
+            partitions["source"].setdefault(doc.get("source", ""), []).append(position)
+            partitions["page_type"].setdefault(page_type, []).append(position)
+            for role in audience:
+                partitions["audience"].setdefault(role, []).append(position)
+        self.partitions = {
+            field: {value: np.array(positions, dtype=np.int64) for value, positions in values.items()}
+            for field, values in partitions.items()
+        }
+        # Knowledge-base position -> row of the embedding matrix (-1: not embedded)
+        self._row_of = np.full(self.num_docs, -1, dtype=np.int64)
+        vector_ids = np.asarray(vector_ids, dtype=np.int64)
+        self._row_of[vector_ids] = np.arange(len(vector_ids))
+        self.num_rows = len(vector_ids)
+        self._selections = {}
+        self._lock = threading.Lock()
+
+    def _union(self, field, values):
+        parts = [self.partitions[field][v] for v in values if v in self.partitions[field]]
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        return parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts))
+
+    def select(self, retrieval_filter):
+        """Selection for a filter, or None when it allows every document."""
+        key = retrieval_filter.key()
+        with self._lock:
+            if key in self._selections:
+                return self._selections[key]
+
+        positions = None
+        if retrieval_filter.sources:
+            positions = self._union("source", retrieval_filter.sources)
+        if retrieval_filter.page_types:
+            allowed = self._union("page_type", retrieval_filter.page_types)
+            positions = allowed if positions is None else np.intersect1d(positions, allowed, assume_unique=True)
+        if retrieval_filter.exclude_page_types:
+            excluded = self._union("page_type", retrieval_filter.exclude_page_types)
+            if len(excluded):
+                base = np.arange(self.num_docs) if positions is None else positions
+                positions = np.setdiff1d(base, excluded, assume_unique=True)
+        audience = [EVERYONE] + ([retrieval_filter.role] if retrieval_filter.role else [])
+        if set(self.partitions["audience"]) - set(audience):
+            allowed = self._union("audience", audience)
+            positions = allowed if positions is None else np.intersect1d(positions, allowed, assume_unique=True)
+
+        selection = None
+        if positions is not None and len(positions) < self.num_docs:
+            rows = self._row_of[positions]
+            rows = np.sort(rows[rows >= 0])
+            selection = Selection(positions, rows, self.num_docs, self.num_rows)
+        with self._lock:
+            if len(self._selections) >= SELECTION_CACHE_SIZE:
+                self._selections.clear()
+            self._selections[key] = selection
+        return selection
+
+    def stats(self):
+        return {field: len(values) for field, values in self.partitions.items()}
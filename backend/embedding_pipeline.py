@@ -0,0 +1,270 @@
+"""
+Batched, concurrent embedding generation for ingestion.
+
+Texts are split into batches (one API request each), sent from a bounded
+thread pool, paced by a token-bucket rate limiter and retried with
+exponential backoff when the API answers 429 / unavailable.
+
+sync_embeddings commits every finished batch to a checkpoint (see
+embedding_store.EmbeddingCheckpoint) before the store is rewritten at the
+end, so rerunning after a crash, rate-limit failure or Ctrl-C only embeds
+what is still missing.
+"""
+
+import os
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import embedding_store
+
+# Used for documents (ingest_data.py, /regenerate-embeddings) and queries (app.py);
+# the store is keyed by this name, so both sides must agree
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "50"))  # Gemini accepts up to 100 per request
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "4"))
+EMBED_REQUESTS_PER_MINUTE = float(os.getenv("EMBED_REQUESTS_PER_MINUTE", "300"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available, then take them."""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            self._sleep(wait)
+
+
+def is_retryable(error):
+    """True for rate-limit (429) and temporarily-unavailable errors."""
+    code = getattr(error, 'code', None)
+    if code in (429, 500, 503):
+        return True
+    name = type(error).__name__
+    if name in ('ResourceExhausted', 'ServiceUnavailable', 'TooManyRequests', 'DeadlineExceeded'):
+        return True
+    return '429' in str(error)
+
+
+def with_backoff(call, max_retries=EMBED_MAX_RETRIES, base_delay=1.0, max_delay=60.0, sleep=time.sleep):
+    """Run call(), retrying retryable errors with jittered exponential backoff."""
+    for attempt in range(max_retries + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            sleep(random.uniform(delay / 2, delay))
+
+
+class GeminiEmbeddingClient:
+    """Embeds a list of texts with one genai.embed_content request.
+
+    genai is the module (or a stand-in for it) to call; by default
+    google.generativeai is imported on first use. With a limiter
+    (upstream_limiter.UpstreamLimiter) each request waits for a shared
+    slot at `priority`, behind chat traffic.
+    """
+
+    def __init__(self, model, task_type="retrieval_document", genai=None, limiter=None, priority="batch"):
+        self.model = model
+        self.task_type = task_type
+        self.genai = genai
+        self.limiter = limiter
+        self.priority = priority
+
+    def embed(self, texts):
+        genai = self.genai
+        if genai is None:
+            import google.generativeai as genai
+        if self.limiter is None:
+            result = genai.embed_content(model=self.model, content=texts, task_type=self.task_type)
+        else:
+            with self.limiter.slot(self.priority):
+                result = genai.embed_content(model=self.model, content=texts, task_type=self.task_type)
+        return result['embedding']
+
+
+class FakeEmbeddingClient:
+    """Deterministic local stand-in for GeminiEmbeddingClient (no network).
+
+    Vectors are seeded from a hash of the text; `latency` seconds are slept per
+    request and `fail_every` makes every n-th request raise a 429-style error.
+    """
+
+    def __init__(self, dim=768, latency=0.0, fail_every=0):
+        self.dim = dim
+        self.latency = latency
+        self.fail_every = fail_every
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def embed(self, texts):
+        with self._lock:
+            self.requests += 1
+            request_number = self.requests
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_every and request_number % self.fail_every == 0:
+            raise RuntimeError("429 Resource has been exhausted (fake)")
+        return [fake_embedding(t, self.dim) for t in texts]
+
+
+def fake_embedding(text, dim=768):
+    seed = int.from_bytes(hashlib.sha1(text.encode('utf-8')).digest()[:8], 'little')
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32).tolist()
+
+
+def embed_texts(texts, client, batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS,
+                requests_per_minute=EMBED_REQUESTS_PER_MINUTE, progress=None, on_batch=None):
+    """Embed texts in batches from a bounded thread pool.
+
+    Returns a list aligned with `texts`; entries of batches that still failed
+    after retries are None. progress(done, total) is called after each batch,
+    on_batch(start, embeddings) after each batch that succeeded. If the caller
+    is interrupted, batches already in flight finish and queued ones are dropped.
+    """
+    texts = list(texts)
+    results = [None] * len(texts)
+    if not texts:
+        return results
+
+    limiter = TokenBucket(requests_per_minute / 60.0, capacity=max(1, workers))
+    batches = [(start, texts[start:start + batch_size]) for start in range(0, len(texts), batch_size)]
+    done = 0
+    done_lock = threading.Lock()
+
+    def run(batch):
+        nonlocal done
+        start, chunk = batch
+
+        def request():
+            limiter.acquire()
+            return client.embed(chunk)
+
+        try:
+            embeddings = with_backoff(request)
+            if len(embeddings) != len(chunk):
+                raise ValueError(f"expected {len(chunk)} embeddings, got {len(embeddings)}")
+            if on_batch:
+                on_batch(start, embeddings)
+            results[start:start + len(embeddings)] = embeddings
+        except Exception as e:
+            print(f"Error embedding batch at {start}: {e}")
+        with done_lock:
+            done += len(chunk)
+            if progress:
+                progress(done, len(texts))
+
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        list(pool.map(run, batches))
+    except BaseException:
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    pool.shutdown()
+    return results
+
+
+def document_text(doc):
+    """Text that gets embedded for a knowledge-base record."""
+    return f"{doc['title']}: {doc['content']}"
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def sync_embeddings(docs, npy_path, client, model, full=False, progress=None, **embed_options):
+    """Bring the embedding store at npy_path in line with docs, embedding only what changed.
+
+    Rows are matched by content hash: unchanged documents keep their stored
+    vector (even if they moved position), new or edited ones are embedded,
+    and rows for documents that no longer exist are dropped. A different
+    embedding model, or full=True, re-embeds everything. Vectors left in the
+    checkpoint by an interrupted run with the same model are reused as well.
+    Returns a stats dict.
+    """
+    texts = [document_text(doc) for doc in docs]
+    hashes = [content_hash(t) for t in texts]
+
+    previous = {}
+    if not full and embedding_store.exists(npy_path):
+        # Read into memory: the file is replaced below (and Windows cannot replace a mapped file)
+        vectors, _, meta = embedding_store.load_embeddings(npy_path, mmap=False)
+        if meta.get("model") == model and meta.get("hashes"):
+            previous = {h: row for row, h in enumerate(meta["hashes"])}
+        else:
+            print("Embedding model or format changed; re-embedding everything")
+
+    checkpoint = embedding_store.EmbeddingCheckpoint(embedding_store.checkpoint_path_for(npy_path), model)
+    resumed = checkpoint.load(h for h in hashes if h not in previous)
+    if resumed:
+        print(f"Resuming: {len(resumed)} embeddings recovered from an interrupted run")
+
+    missing = [i for i, h in enumerate(hashes) if h not in previous and h not in resumed]
+
+    def save_batch(start, embeddings):
+        checkpoint.add([hashes[i] for i in missing[start:start + len(embeddings)]], embeddings)
+
+    try:
+        embedded = embed_texts([texts[i] for i in missing], client, progress=progress,
+                               on_batch=save_batch, **embed_options)
+    except BaseException:
+        checkpoint.close()
+        print("Embedding interrupted; finished batches are checkpointed, rerun to resume")
+        raise
+    fresh = {i: e for i, e in zip(missing, embedded) if e}
+
+    rows = []
+    for i, h in enumerate(hashes):
+        if h in previous:
+            rows.append((i, h, vectors[previous[h]]))
+        elif h in resumed:
+            rows.append((i, h, resumed[h]))
+        elif i in fresh:
+            rows.append((i, h, fresh[i]))
+
+    if rows:
+        matrix = np.array([r[2] for r in rows], dtype=np.float32)
+    else:
+        matrix = np.zeros((0, 0), dtype=np.float32)
+    embedding_store.save_embeddings(
+        npy_path, matrix, [r[0] for r in rows], model=model, hashes=[r[1] for r in rows]
+    )
+    # Everything the checkpoint held is in the store now
+    checkpoint.discard()
+
+    kept = set(hashes)
+    stats = {
+        "documents": len(docs),
+        "reused": sum(1 for h in hashes if h in previous),
+        "resumed": sum(1 for h in hashes if h not in previous and h in resumed),
+        "embedded": len(fresh),
+        "failed": len(missing) - len(fresh),
+        "dropped": sum(1 for h in previous if h not in kept),
+    }
+    print(f"DONE: Embeddings synced - {stats['reused']} reused, {stats['resumed']} resumed, "
+          f"{stats['embedded']} embedded, {stats['failed']} failed, {stats['dropped']} dropped")
+    return stats
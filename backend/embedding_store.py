@@ -0,0 +1,175 @@
+"""
+Binary on-disk store for document embeddings.
+
+Embeddings are written as a float32 .npy matrix (rows L2-normalized) plus a
+small JSON sidecar with the document ids and metadata. Loading memory-maps
+the matrix, so worker processes share the same pages through the OS cache.
+
+While an ingestion run is embedding, finished batches are also committed to
+a SQLite checkpoint next to the matrix (embeddings.checkpoint.db), so a run
+that dies before the final write can pick up where it stopped.
+
+Convert an existing embeddings.json with:
+    python embedding_store.py embeddings.json
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import threading
+import numpy as np
+from vector_index import normalize
+
+FORMAT_VERSION = 1
+
+
+def meta_path_for(npy_path):
+    """Sidecar path for an embeddings matrix, e.g. embeddings.npy -> embeddings.meta.json."""
+    root, _ = os.path.splitext(npy_path)
+    return root + ".meta.json"
+
+
+def checkpoint_path_for(npy_path):
+    """Checkpoint path for an embeddings matrix, e.g. embeddings.npy -> embeddings.checkpoint.db."""
+    root, _ = os.path.splitext(npy_path)
+    return root + ".checkpoint.db"
+
+
+def _atomic_write(path, write):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def save_embeddings(npy_path, vectors, ids, model=None, hashes=None):
+    """Write normalized float32 vectors and their ids to npy_path + sidecar.
+
+    hashes, if given, are the content hashes of the embedded texts (aligned
+    with ids) and let incremental ingestion reuse unchanged rows.
+    """
+    vectors = normalize(np.asarray(vectors, dtype=np.float32))
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "count": int(vectors.shape[0]),
+        "dim": int(vectors.shape[1]),
+        "dtype": "float32",
+        "normalized": True,
+        "model": model,
+        "ids": [int(i) for i in ids],
+        "hashes": list(hashes) if hashes is not None else None,
+    }
+
+    # Matrix first, sidecar last: readers key off the sidecar count.
+    _atomic_write(npy_path, lambda f: np.save(f, vectors))
+    _atomic_write(meta_path_for(npy_path),
+                  lambda f: f.write(json.dumps(meta).encode('utf-8')))
+    return meta
+
+
+def save_records(npy_path, records, model=None):
+    """Save [{'index': i, 'embedding': [...], 'hash': ...}, ...] records in the binary format."""
+    ids = [r['index'] for r in records]
+    hashes = [r['hash'] for r in records] if all('hash' in r for r in records) else None
+    if records:
+        vectors = np.array([r['embedding'] for r in records], dtype=np.float32)
+    else:
+        vectors = np.zeros((0, 0), dtype=np.float32)
+    return save_embeddings(npy_path, vectors, ids, model=model, hashes=hashes)
+
+
+def load_embeddings(npy_path, mmap=True):
+    """Return (vectors, ids, meta). vectors is a read-only memmap when mmap=True."""
+    with open(meta_path_for(npy_path), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    # numpy cannot memory-map a zero-length array
+    use_mmap = mmap and meta["count"] > 0
+    vectors = np.load(npy_path, mmap_mode='r' if use_mmap else None)
+    if vectors.shape[0] != meta["count"]:
+        raise ValueError(
+            f"{npy_path} has {vectors.shape[0]} rows but sidecar lists {meta['count']}"
+        )
+    ids = np.asarray(meta["ids"], dtype=np.int64)
+    return vectors, ids, meta
+
+
+def exists(npy_path):
+    return os.path.exists(npy_path) and os.path.exists(meta_path_for(npy_path))
+
+
+def convert_json(json_path, npy_path=None, model=None):
+    """One-shot conversion of a legacy embeddings.json file to the binary store."""
+    if npy_path is None:
+        npy_path = os.path.splitext(json_path)[0] + ".npy"
+    with open(json_path, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    meta = save_records(npy_path, records, model=model)
+    print(f"DONE: Converted {meta['count']} embeddings ({meta['dim']} dims) to {npy_path}")
+    return npy_path
+
+
+class EmbeddingCheckpoint:
+    """Durable record of vectors embedded by an unfinished ingestion run.
+
+    Vectors are keyed by content hash and model, so a restarted run reuses
+    every batch that finished before the crash regardless of order. Each
+    add() is its own transaction; discard() deletes the file once the
+    embedding store has been written.
+    """
+
+    def __init__(self, path, model):
+        self.path = path
+        self.model = model or ""
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "hash TEXT NOT NULL, model TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (hash, model))"
+        )
+
+    def load(self, hashes=None):
+        """Return {hash: float32 vector} for this model, limited to `hashes` if given."""
+        wanted = set(hashes) if hashes is not None else None
+        found = {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT hash, vector FROM embeddings WHERE model = ?", (self.model,)
+            )
+            for h, blob in rows:
+                if wanted is None or h in wanted:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def add(self, hashes, vectors):
+        rows = [(h, self.model, np.asarray(v, dtype=np.float32).tobytes())
+                for h, v in zip(hashes, vectors)]
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (hash, model, vector) VALUES (?, ?, ?)", rows
+                )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def discard(self):
+        """Close and delete the checkpoint (and its WAL files)."""
+        self.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python embedding_store.py <embeddings.json> [output.npy]")
+        sys.exit(1)
+    convert_json(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
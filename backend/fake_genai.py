@@ -0,0 +1,145 @@
+"""
+Deterministic, offline stand-in for the parts of google.generativeai the
+backend calls: genai.embed_content (single text or batch, sync and async)
+and GenerativeModel.generate_content (plain, streamed, sync and async).
+
+Embeddings come from embedding_pipeline.fake_embedding, so the same text
+always maps to the same vector. Answers are derived from a hash of the
+prompt. Every call sleeps for a configurable latency so benchmarks see
+realistic upstream waits without touching the network.
+
+    fake = FakeGenAI(embed_latency=0.05, gen_latency=0.5)
+    fake.install(app)          # patches the app.genai and app.model proxies in place
+"""
+
+import time
+import asyncio
+import hashlib
+import threading
+from chunking import estimate_tokens
+from embedding_pipeline import fake_embedding
+
+ANSWER_WORDS = (
+    "We build homes, offices and renovations across Chennai, Coimbatore and Madurai. "
+    "Our engineers handle foundations, structural design and site supervision. "
+    "Contact us for a free consultation and a detailed quote."
+).split()
+
+
+class UsageMetadata:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    """Mimics GenerateContentResponse: .text and .usage_metadata."""
+
+    def __init__(self, text, prompt_tokens):
+        self.text = text
+        self.usage_metadata = UsageMetadata(prompt_tokens, estimate_tokens(text))
+
+
+class FakeStream:
+    """Iterable (sync or async) of response chunks with aggregated usage_metadata."""
+
+    def __init__(self, chunks, prompt_tokens, chunk_latency):
+        self._chunks = chunks
+        self._chunk_latency = chunk_latency
+        self.usage_metadata = UsageMetadata(prompt_tokens, estimate_tokens("".join(chunks)))
+
+    def __iter__(self):
+        for text in self._chunks:
+            if self._chunk_latency:
+                time.sleep(self._chunk_latency)
+            yield FakeResponse(text, 0)
+
+    async def __aiter__(self):
+        for text in self._chunks:
+            if self._chunk_latency:
+                await asyncio.sleep(self._chunk_latency)
+            yield FakeResponse(text, 0)
+
+
+class FakeGenAI:
+    """Configurable fake Gemini backend that counts the calls it serves.
+
+    embed_latency is slept per embed_content request (batch or single),
+    gen_latency per generate_content call; streamed answers spread
+    gen_latency over stream_chunks chunks.
+    """
+
+    def __init__(self, embed_latency=0.0, gen_latency=0.0, dim=768, answer_words=40, stream_chunks=8):
+        self.embed_latency = embed_latency
+        self.gen_latency = gen_latency
+        self.dim = dim
+        self.answer_words = answer_words
+        self.stream_chunks = stream_chunks
+        self.embed_calls = 0
+        self.generate_calls = 0
+        self._lock = threading.Lock()
+
+    def _count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def _embed(self, content):
+        if isinstance(content, str):
+            return {'embedding': fake_embedding(content, self.dim)}
+        return {'embedding': [fake_embedding(text, self.dim) for text in content]}
+
+    def embed_content(self, model=None, content=None, task_type=None, **kwargs):
+        self._count("embed_calls")
+        if self.embed_latency:
+            time.sleep(self.embed_latency)
+        return self._embed(content)
+
+    async def embed_content_async(self, model=None, content=None, task_type=None, **kwargs):
+        self._count("embed_calls")
+        if self.embed_latency:
+            await asyncio.sleep(self.embed_latency)
+        return self._embed(content)
+
+    def answer_for(self, prompt):
+        seed = int.from_bytes(hashlib.sha1(prompt.encode('utf-8')).digest()[:4], 'little')
+        words = [ANSWER_WORDS[(seed + i) % len(ANSWER_WORDS)] for i in range(self.answer_words)]
+        return " ".join(words)
+
+    def _stream(self, prompt):
+        words = self.answer_for(prompt).split(" ")
+        size = max(1, -(-len(words) // self.stream_chunks))
+        chunks = [" ".join(words[i:i + size]) + " " for i in range(0, len(words), size)]
+        return FakeStream(chunks, estimate_tokens(prompt), self.gen_latency / len(chunks))
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        self._count("generate_calls")
+        if stream:
+            return self._stream(prompt)
+        if self.gen_latency:
+            time.sleep(self.gen_latency)
+        return FakeResponse(self.answer_for(prompt), estimate_tokens(prompt))
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False, **kwargs):
+        self._count("generate_calls")
+        if stream:
+            return self._stream(prompt)
+        if self.gen_latency:
+            await asyncio.sleep(self.gen_latency)
+        return FakeResponse(self.answer_for(prompt), estimate_tokens(prompt))
+
+    def install(self, app_module):
+        """Route app_module's genai embedding calls and its model through this fake.
+
+        app_module.genai is a lazy proxy, so nothing is imported; the app's
+        GeminiEmbeddingClient calls through it and goes through the fake as well.
+        """
+        app_module.genai.embed_content = self.embed_content
+        app_module.genai.embed_content_async = self.embed_content_async
+        app_module.model.generate_content = self.generate_content
+        app_module.model.generate_content_async = self.generate_content_async
+        return self
+
+    def stats(self):
+        with self._lock:
+            return {"embed_calls": self.embed_calls, "generate_calls": self.generate_calls}
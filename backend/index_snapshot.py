@@ -0,0 +1,136 @@
+"""
+Immutable, versioned snapshot of everything retrieval reads.
+
+A request takes app.snapshot once and uses only that object. Reloads build
+a new snapshot off the request path and publish it with a single reference
+assignment, so a request sees either the old index or the new one, never a
+half-built mix. Snapshots are not mutated after construction.
+"""
+
+import os
+import time
+import itertools
+import threading
+import numpy as np
+from doc_filters import FilterIndex
+
+_versions = itertools.count(1)
+
+
+class IndexSnapshot:
+    """Knowledge base, BM25 index, vector index and optional IVF or quantized index from one load."""
+
+    def __init__(self, knowledge_base, keyword_index, vectors, ann_index=None):
+        self.knowledge_base = knowledge_base
+        self.keyword_index = keyword_index
+        self.vectors = vectors
+        self.ann_index = ann_index
+        self.filters = FilterIndex(knowledge_base, vectors.ids)
+        self.version = next(_versions)
+        self.loaded_at = time.time()
+
+    @property
+    def searcher(self):
+        """The IVF or quantized index if one was built, else exact search over all vectors."""
+        return self.ann_index or self.vectors
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "loaded_at": round(self.loaded_at, 3),
+            "documents": len(self.knowledge_base),
+            "embeddings": len(self.vectors),
+            "ivf_lists": getattr(self.ann_index, "nlist", 0),
+            "quantization": getattr(self.ann_index, "kind", None),
+            "code_bytes": getattr(self.ann_index, "nbytes", 0),
+            "filter_partitions": self.filters.stats(),
+        }
+
+
+def align_embeddings(vectors, ids, stored_hashes, doc_hashes):
+    """Map stored embedding rows onto knowledge-base positions by content hash.
+
+    Returns (vectors, ids). Rows whose text is no longer in the knowledge base
+    are dropped, so a knowledge base reloaded before its embeddings are synced
+    never returns the wrong document for a vector. When every row already
+    lines up (the normal case) the inputs are returned untouched, keeping a
+    memmap a memmap. Stores without hashes are trusted as far as ids go.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if stored_hashes is None:
+        keep = ids < len(doc_hashes)
+        return (vectors, ids) if keep.all() else (vectors[keep], ids[keep])
+
+    if all(i < len(doc_hashes) and doc_hashes[i] == h for i, h in zip(ids.tolist(), stored_hashes)):
+        return vectors, ids
+
+    positions = {}
+    for position, h in enumerate(doc_hashes):
+        positions.setdefault(h, []).append(position)
+    rows = []
+    new_ids = []
+    for row, h in enumerate(stored_hashes):
+        free = positions.get(h)
+        if free:
+            rows.append(row)
+            new_ids.append(free.pop(0))
+    return vectors[rows], np.array(new_ids, dtype=np.int64)
+
+
+class FileWatcher:
+    """Poll file mtimes in a daemon thread and call on_change once they settle.
+
+    A change fires only after the files have stayed the same for one more
+    interval, so a multi-file write (knowledge base, then embeddings) is not
+    picked up halfway through a single file.
+    """
+
+    def __init__(self, paths, on_change, interval=5.0):
+        self.paths = list(paths)
+        self.on_change = on_change
+        self.interval = interval
+        self._seen = self.signature()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def signature(self):
+        sig = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                sig.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                sig.append(None)
+        return tuple(sig)
+
+    def mark_seen(self):
+        """Treat the files' current state as already loaded."""
+        self._seen = self.signature()
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="index-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        """Stop polling and wait up to timeout seconds for the thread (a reload in progress may finish later)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        pending = None
+        while not self._stop.wait(self.interval):
+            current = self.signature()
+            if current == self._seen:
+                pending = None
+            elif current != pending:
+                pending = current  # changed; wait one interval for it to settle
+            else:
+                pending = None
+                self._seen = current
+                try:
+                    self.on_change()
+                except Exception as e:
+                    print(f"Error reloading after file change: {e}")
@@ -4,12 +4,20 @@ Extracts content from HTML files and generates vector embeddings.
 """
 
 import os
-import json
+import sys
+import argparse
 from pathlib import Path
-from bs4 import BeautifulSoup
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from bs4 import BeautifulSoup, Comment, Declaration, Doctype, ProcessingInstruction
 import google.generativeai as genai
 from dotenv import load_dotenv
-import time
+from embedding_pipeline import GeminiEmbeddingClient, sync_embeddings, document_text, EMBEDDING_MODEL
+from chunking import chunk_document
+from bm25_index import BM25Index, bm25_path_for
+from kb_store import RecordWriter, iter_records, read_records
+from doc_filters import page_metadata
+from upstream_limiter import UpstreamLimiter
 
 # Load environment variables
 load_dotenv()
@@ -21,175 +29,252 @@ if api_key:
 else:
     print("WARNING: GEMINI_API_KEY not found. Embeddings will not be generated.")
 
-def extract_text_from_html(html_path):
-    """Extract clean text from HTML file."""
+HEADING_TAGS = ["h1", "h2", "h3", "h4", "h5", "h6"]
+HTML_SUFFIXES = (".html", ".htm")
+SKIP_DIRS = {"node_modules", "dist", "build", "__pycache__", "venv"}
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+
+def resolve_parser(name):
+    """BeautifulSoup parser to use: lxml when installed (several times faster), else html.parser."""
+    if name != "auto":
+        return name
+    try:
+        import lxml  # noqa: F401
+        return "lxml"
+    except ImportError:
+        return "html.parser"
+
+HTML_PARSER = resolve_parser(os.getenv("HTML_PARSER", "auto"))
+
+def clean_text(text):
+    """Collapse whitespace runs and blank lines into single spaces."""
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return ' '.join(chunk for chunk in chunks if chunk)
+
+def extract_sections_from_html(html_path):
+    """Extract clean text from HTML file, split at headings.
+
+    Returns (text, sections) where sections is [(heading, start, end), ...]
+    with character offsets into text.
+    """
     with open(html_path, 'r', encoding='utf-8') as f:
-        soup = BeautifulSoup(f.read(), 'html.parser')
+        soup = BeautifulSoup(f.read(), HTML_PARSER)
     
     # Remove script and style elements
     for script in soup(["script", "style"]):
         script.decompose()
     
-    # Get text
-    text = soup.get_text()
+    # Group text nodes under the most recent heading
+    groups = [("", [])]
+    current_heading = None
+    for string in soup.find_all(string=True):
+        if isinstance(string, (Comment, Declaration, Doctype, ProcessingInstruction)):
+            continue
+        heading = string.find_parent(HEADING_TAGS)
+        if heading is not None and heading is not current_heading:
+            groups.append((clean_text(heading.get_text()), []))
+        elif heading is None and current_heading is not None:
+            groups[-1][1].append("\n")  # keep the heading apart from its body text
+        current_heading = heading
+        groups[-1][1].append(string)
     
-    # Clean up text
-    lines = (line.strip() for line in text.splitlines())
-    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-    text = ' '.join(chunk for chunk in chunks if chunk)
+    parts = []
+    sections = []
+    offset = 0
+    for heading, strings in groups:
+        section_text = clean_text(''.join(strings))
+        if not section_text:
+            continue
+        if parts:
+            offset += 1  # joining space
+        sections.append((heading, offset, offset + len(section_text)))
+        parts.append(section_text)
+        offset += len(section_text)
     
-    return text
+    return ' '.join(parts), sections
 
-def get_embedding(text):
-    """Get embedding for a piece of text using Gemini's embedding model."""
-    if not api_key:
-        return None
-        
+# Metadata for known pages, keyed by path relative to the source directory
+PAGE_INFO = {
+    "index.html": {
+        "title": "Home - Engineers Veedu",
+        "description": "Construction contractor services, portfolio, and trust signals"
+    },
+    "support.html": {
+        "title": "Support - Engineers Veedu",
+        "description": "Customer support, contact information, and FAQ"
+    },
+    "community.html": {
+        "title": "Community - Engineers Veedu",
+        "description": "Community features and project collaboration"
+    },
+    "login.html": {
+        "title": "Login - Engineers Veedu",
+        "description": "User login page"
+    },
+    "register.html": {
+        "title": "Register - Engineers Veedu",
+        "description": "User registration page"
+    },
+    "dash.html": {
+        "title": "Contractor Dashboard",
+        "description": "Dashboard for engineers and contractors"
+    },
+    "client_dash.html": {
+        "title": "Client Dashboard",
+        "description": "Dashboard for clients to manage requests"
+    }
+}
+
+CUSTOM_KNOWLEDGE = [
+    {
+        "source": "company_info",
+        "title": "Company Overview",
+        "description": "Engineers Veedu company information",
+        "content": """
+        Engineers Veedu is a professional construction contractor with over 10 years of experience.
+        Services include: residential construction, commercial buildouts, renovations, foundation work,
+        and structural engineering. The company is certified and insured. Service areas include
+        Chennai, Coimbatore, and Madurai regions.
+        """
+    },
+    {
+        "source": "contact_info",
+        "title": "Contact Information",
+        "description": "How to contact Engineers Veedu",
+        "content": """
+        Contact Information:
+        - Phone: +1 (555) 123-4567
+        - Email: support@contractorpro.com
+        - Business Hours: Monday-Friday 8AM-6PM EST
+        """
+    },
+    {
+        "source": "projects",
+        "title": "Portfolio",
+        "description": "Recent construction projects",
+        "content": """
+        Recent Projects:
+        1. Commercial Buildout - Modern office space delivered on time and within budget
+        2. Luxury Home Renovation - Full interior and exterior remodeling
+        3. Foundation & Structurals - Expert structural work ensuring long-term stability
+        """
+    }
+]
+
+def discover_html_files(root):
+    """Yield HTML files under root recursively, in sorted order, skipping build and dependency dirs."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS and not d.startswith("."))
+        for name in sorted(filenames):
+            if name.lower().endswith(HTML_SUFFIXES):
+                yield Path(dirpath) / name
+
+def extract_page(html_path, source):
+    """Extract and chunk one page (runs in a worker process).
+
+    Returns (source, chunks, error); error is None on success.
+    """
     try:
-        # Add delay to avoid rate limiting
-        time.sleep(0.5)
-        result = genai.embed_content(
-            model="models/text-embedding-004",
-            content=text,
-            task_type="retrieval_document"
-        )
-        return result['embedding']
+        text, sections = extract_sections_from_html(html_path)
+        metadata = PAGE_INFO.get(source, {
+            "title": source,
+            "description": f"Content from {source}"
+        })
+        chunks = chunk_document({
+            "source": source,
+            "title": metadata["title"],
+            "description": metadata["description"],
+            "content": text,
+            **page_metadata(source)
+        }, sections=sections)
+        return source, chunks, None
     except Exception as e:
-        print(f"Error getting embedding: {e}")
-        return None
+        return source, [], str(e)
 
-def create_knowledge_base():
-    """Create knowledge base from website HTML files."""
-    website_dir = Path(__file__).parent.parent / "frontend"
-    html_files = list(website_dir.glob("*.html"))
-    
-    knowledge_base = []
-    
-    # Define metadata for each page
-    page_info = {
-        "index.html": {
-            "title": "Home - Engineers Veedu",
-            "description": "Construction contractor services, portfolio, and trust signals"
-        },
-        "support.html": {
-            "title": "Support - Engineers Veedu",
-            "description": "Customer support, contact information, and FAQ"
-        },
-        "community.html": {
-            "title": "Community - Engineers Veedu",
-            "description": "Community features and project collaboration"
-        },
-        "login.html": {
-            "title": "Login - Engineers Veedu",
-            "description": "User login page"
-        },
-        "register.html": {
-            "title": "Register - Engineers Veedu",
-            "description": "User registration page"
-        },
-        "dash.html": {
-            "title": "Contractor Dashboard",
-            "description": "Dashboard for engineers and contractors"
-        },
-        "client_dash.html": {
-            "title": "Client Dashboard",
-            "description": "Dashboard for clients to manage requests"
-        }
-    }
-    
-    print("Extracting content from HTML files...")
-    for html_file in html_files:
-        try:
-            text = extract_text_from_html(html_file)
-            filename = html_file.name
-            
-            metadata = page_info.get(filename, {
-                "title": filename,
-                "description": f"Content from {filename}"
-            })
-            
-            knowledge_base.append({
-                "source": filename,
-                "title": metadata["title"],
-                "description": metadata["description"],
-                "content": text
-            })
-            print(f"  Processed {filename}")
-        except Exception as e:
-            print(f"  Error processing {html_file}: {e}")
-    
-    # Add custom knowledge
-    custom_knowledge = [
-        {
-            "source": "company_info",
-            "title": "Company Overview",
-            "description": "Engineers Veedu company information",
-            "content": """
-            Engineers Veedu is a professional construction contractor with over 10 years of experience.
-            Services include: residential construction, commercial buildouts, renovations, foundation work,
-            and structural engineering. The company is certified and insured. Service areas include
-            Chennai, Coimbatore, and Madurai regions.
-            """
-        },
-        {
-            "source": "contact_info",
-            "title": "Contact Information",
-            "description": "How to contact Engineers Veedu",
-            "content": """
-            Contact Information:
-            - Phone: +1 (555) 123-4567
-            - Email: support@contractorpro.com
-            - Business Hours: Monday-Friday 8AM-6PM EST
-            """
-        },
-        {
-            "source": "projects",
-            "title": "Portfolio",
-            "description": "Recent construction projects",
-            "content": """
-            Recent Projects:
-            1. Commercial Buildout - Modern office space delivered on time and within budget
-            2. Luxury Home Renovation - Full interior and exterior remodeling
-            3. Foundation & Structurals - Expert structural work ensuring long-term stability
-            """
-        }
-    ]
-    
-    knowledge_base.extend(custom_knowledge)
+def map_bounded(executor, fn, jobs, window):
+    """Like executor.map, but with at most `window` jobs submitted and unread at a time.
+
+    Results come back in submission order; a slow page holds back at most
+    `window` finished results, so memory does not grow with the corpus.
+    """
+    pending = deque()
+    for args in jobs:
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def extract_pages(root, workers=INGEST_WORKERS):
+    """Yield (source, chunks, error) for every HTML page under root, extracted in parallel."""
+    jobs = ((path, path.relative_to(root).as_posix()) for path in discover_html_files(root))
+    if workers <= 1:
+        for args in jobs:
+            yield extract_page(*args)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from map_bounded(executor, extract_page, jobs, window=workers * 4)
+
+def create_knowledge_base(embedding_client=None, full=False, source_dir=None, workers=INGEST_WORKERS):
+    """Create knowledge base from website HTML files.
+
+    Pages under source_dir (default: frontend/) are found recursively,
+    extracted in a process pool, and streamed to knowledge_base.jsonl.
+    Only new or changed documents are embedded unless full=True.
+    embedding_client defaults to Gemini; pass a FakeEmbeddingClient to run offline.
+    """
+    website_dir = Path(source_dir) if source_dir else Path(__file__).parent.parent / "frontend"
+    output_path = os.path.join(os.path.dirname(__file__), "knowledge_base.jsonl")
     
-    # Save knowledge base to JSON
-    output_path = os.path.join(os.path.dirname(__file__), "knowledge_base.json")
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(knowledge_base, f, indent=2, ensure_ascii=False)
+    print(f"Extracting content from HTML files under {website_dir} ({HTML_PARSER}, {workers} workers)...")
+    pages = 0
+    with RecordWriter(output_path) as writer:
+        for source, chunks, error in extract_pages(website_dir, workers):
+            if error is not None:
+                print(f"  Error processing {source}: {error}")
+                continue
+            writer.write_all(chunks)
+            pages += 1
+            print(f"  Processed {source} ({len(chunks)} chunks)")
+        
+        # Add custom knowledge
+        for doc in CUSTOM_KNOWLEDGE:
+            writer.write_all(chunk_document({**doc, **page_metadata(doc["source"])}))
     
     print(f"\n✅ Knowledge base created at {output_path}")
-    print(f"Total documents: {len(knowledge_base)}")
+    print(f"Pages: {pages}, total chunks: {writer.count}")
+    
+    # Build the BM25 keyword index alongside it, reading the records back one at a time
+    BM25Index.build(document_text(doc) for doc in iter_records(output_path)).save(bm25_path_for(output_path))
+    print("✅ Keyword index saved")
     
     # Generate embeddings
-    if api_key:
+    if embedding_client is None and api_key:
+        # Shares the running app's Gemini limits, yielding to its chat traffic
+        embedding_client = GeminiEmbeddingClient(EMBEDDING_MODEL, limiter=UpstreamLimiter())
+    if embedding_client:
         print("\nGenerating embeddings...")
-        document_embeddings = []
-        
-        for i, doc in enumerate(knowledge_base):
-            text = f"{doc['title']}: {doc['content']}"
-            embedding = get_embedding(text)
-            
-            if embedding:
-                document_embeddings.append({
-                    'index': i,
-                    'embedding': embedding
-                })
-            print(f"  Embedded {i+1}/{len(knowledge_base)}")
-        
-        # Save embeddings
-        embeddings_path = os.path.join(os.path.dirname(__file__), "embeddings.json")
-        with open(embeddings_path, 'w', encoding='utf-8') as f:
-            json.dump(document_embeddings, f)
-        
-        print(f"✅ Saved {len(document_embeddings)} embeddings to {embeddings_path}")
+        embeddings_path = os.path.join(os.path.dirname(__file__), "embeddings.npy")
+        sync_embeddings(
+            read_records(output_path), embeddings_path, embedding_client, EMBEDDING_MODEL, full=full,
+            progress=lambda done, total: print(f"  Embedded {done}/{total}")
+        )
+        print(f"✅ Saved embeddings to {embeddings_path}")
     
-    return knowledge_base
+    return output_path
 
 
 if __name__ == "__main__":
-    create_knowledge_base()
+    parser = argparse.ArgumentParser(description="Build the chatbot knowledge base from HTML pages.")
+    parser.add_argument('--full', action='store_true', help="Re-embed every document")
+    parser.add_argument('--source', help="Directory to scan for HTML (default: ../frontend)")
+    parser.add_argument('--workers', type=int, default=INGEST_WORKERS,
+                        help="Extraction processes (1 = no pool)")
+    args = parser.parse_args()
+    try:
+        create_knowledge_base(full=args.full, source_dir=args.source, workers=args.workers)
+    except KeyboardInterrupt:
+        print("\nInterrupted. Run ingest_data.py again to resume.")
+        sys.exit(130)
@@ -0,0 +1,144 @@
+"""
+Approximate nearest-neighbour search with an inverted-file (IVF-flat) index.
+
+Document vectors are grouped around k-means centroids. A query is scored
+against the centroids first and then only against the documents in the
+nprobe closest lists, trading a little recall for much less work on large
+corpora. Pure NumPy; the document matrix itself is shared with VectorIndex.
+"""
+
+import os
+import hashlib
+import numpy as np
+from vector_index import normalize, top_k_from_scores
+
+ASSIGN_BATCH = 8192
+
+
+def ivf_path_for(npy_path):
+    """Index file stored next to the embeddings, e.g. embeddings.npy -> embeddings.ivf.npz."""
+    root, _ = os.path.splitext(npy_path)
+    return root + ".ivf.npz"
+
+
+def fingerprint(base):
+    """Cheap identity of an embedding matrix, used to detect a stale IVF file."""
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(base.ids).tobytes())
+    step = max(1, len(base) // 64)
+    h.update(np.ascontiguousarray(base.vectors[::step]).tobytes())
+    return h.hexdigest()
+
+
+def assign(vectors, centroids):
+    """Nearest centroid (by cosine) for every row, computed in batches."""
+    labels = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], ASSIGN_BATCH):
+        batch = np.asarray(vectors[start:start + ASSIGN_BATCH], dtype=np.float32)
+        labels[start:start + ASSIGN_BATCH] = np.argmax(batch @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(vectors, nlist, iterations=10, sample_size=None, seed=0):
+    """Spherical k-means on a random sample of the (normalized) rows."""
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    sample_size = min(n, sample_size or max(nlist * 64, 10000))
+    sample_rows = np.sort(rng.choice(n, size=sample_size, replace=False))
+    sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+
+    centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        # Re-seed empty lists from random sample points
+        if empty.any():
+            sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    """IVF-flat index over the rows of a VectorIndex."""
+
+    def __init__(self, base, centroids, order, offsets, nprobe=8, source=None):
+        self.base = base
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.order = np.asarray(order, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.nprobe = nprobe
+        self.source = source
+
+    @classmethod
+    def build(cls, base, nlist=None, nprobe=8, iterations=10, seed=0):
+        """Cluster the rows of base into nlist inverted lists."""
+        n = len(base)
+        if nlist is None:
+            nlist = int(np.sqrt(n)) or 1
+        nlist = max(1, min(nlist, n))
+        centroids = train_centroids(base.vectors, nlist, iterations=iterations, seed=seed)
+        labels = assign(base.vectors, centroids)
+        order = np.argsort(labels, kind='stable')
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=nlist))
+        return cls(base, centroids, order, offsets, nprobe=nprobe, source=fingerprint(base))
+
+    @classmethod
+    def load(cls, path, base, nprobe=8):
+        """Load a saved index; returns None if it was built from other embeddings."""
+        with np.load(path) as data:
+            if str(data['source']) != fingerprint(base):
+                return None
+            return cls(base, data['centroids'], data['order'], data['offsets'],
+                       nprobe=nprobe, source=str(data['source']))
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp.{os.getpid()}.npz"
+        np.savez(tmp_path, centroids=self.centroids, order=self.order,
+                 offsets=self.offsets, source=np.array(self.source))
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.base)
+
+    @property
+    def nlist(self):
+        return self.centroids.shape[0]
+
+    def search(self, query_embedding, top_k=3, nprobe=None, rows=None, excluded_rows=None):
+        """Return [(doc_index, similarity), ...] from the nprobe closest lists.
+
+        rows (sorted matrix row numbers) limits the search to a subset; a
+        subset smaller than the probed lists is scanned exactly instead.
+        excluded_rows (the complement) is the cheaper test for a large subset.
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+        if rows is not None and len(rows) <= len(self) * min(nprobe or self.nprobe, self.nlist) / self.nlist:
+            return self.base.search(query_embedding, top_k, rows=rows, excluded_rows=excluded_rows)
+
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        query = normalize(np.asarray(query_embedding, dtype=np.float32))
+
+        centroid_scores = self.centroids @ query
+        if nprobe < self.nlist:
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probes = np.arange(self.nlist)
+
+        allowed = rows
+        rows = np.concatenate([
+            self.order[self.offsets[p]:self.offsets[p + 1]] for p in probes
+        ])
+        rows.sort()  # sequential reads from a memory-mapped matrix
+        if excluded_rows is not None and len(excluded_rows) < len(allowed):
+            rows = rows[~np.isin(rows, excluded_rows, assume_unique=True)]
+        elif allowed is not None:
+            rows = rows[np.isin(rows, allowed, assume_unique=True)]
+        if rows.size == 0:
+            return []
+        scores = self.base.vectors[rows] @ query
+        return top_k_from_scores(scores, self.base.ids[rows], top_k)
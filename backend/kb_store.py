@@ -0,0 +1,66 @@
+"""
+Knowledge-base file I/O.
+
+ingest_data.py streams chunk records to knowledge_base.jsonl (one JSON
+object per line) through RecordWriter, which writes to a temp file and
+renames it into place on close, so readers and the app's file watcher never
+see a half-written knowledge base. The older knowledge_base.json (one JSON
+array) is still readable.
+"""
+
+import os
+import json
+
+
+def iter_records(path):
+    """Yield records from a .jsonl file one line at a time, or from a legacy .json array."""
+    if path.endswith(".jsonl"):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+
+
+def read_records(path):
+    return list(iter_records(path))
+
+
+class RecordWriter:
+    """Append records to a JSON Lines file, published atomically on close()."""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._tmp_path = f"{path}.tmp.{os.getpid()}"
+        self._file = open(self._tmp_path, 'w', encoding='utf-8')
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False))
+        self._file.write("\n")
+        self.count += 1
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
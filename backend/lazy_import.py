@@ -0,0 +1,44 @@
+"""
+Deferred construction of heavy module-level objects.
+
+google.generativeai pulls in gRPC, protobuf and the generated API clients,
+which is most of the app's import time. A LazyObject stands in for such a
+module (or an object built from it) and builds the real thing on first
+attribute access, or when resolve() is called during warm-up.
+
+Attributes assigned on the proxy shadow the target, so a fake can be
+patched in (e.g. fake_genai.FakeGenAI.install) without importing anything.
+"""
+
+import threading
+
+
+class LazyObject:
+    """Proxy that calls factory() once, on first use, and forwards attribute access to the result."""
+
+    def __init__(self, factory, name):
+        self._factory = factory
+        self._name = name
+        self._target = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+        return self._target
+
+    @property
+    def loaded(self):
+        return self._target is not None
+
+    def __getattr__(self, name):
+        # Only called for attributes not set on the proxy itself
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<LazyObject {self._name} ({state})>"
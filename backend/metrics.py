@@ -0,0 +1,214 @@
+"""
+In-process metrics in the Prometheus text format.
+
+Histograms and counters live in this process (each Gunicorn/uvicorn worker
+keeps its own; Prometheus sums them per instance). Wrap a stage of the hot
+path in `with span("stage"):` to record its duration in
+chatbot_stage_duration_seconds{stage=...}. Stats that already exist
+elsewhere (caches, sessions, hashing) are exported by collectors that are
+called at scrape time, so the request path does not count them twice.
+
+PROFILE_SAMPLE_RATE > 0 runs that fraction of instrumented requests under
+cProfile and writes one .prof file per request to PROFILE_DIR (inspect with
+`python -m pstats file.prof` or snakeviz). At most one request is profiled
+at a time.
+"""
+
+import os
+import time
+import random
+import cProfile
+import functools
+import threading
+from contextlib import contextmanager
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), "profiles"))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metrics = []
+_collectors = []
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple((n, labels[n]) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple((n, labels[n]) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for key, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                labels = key + (("le", _number(bound)),)
+                lines.append(f"{self.name}_bucket{_label_text(labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(key)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_label_text(key)} {cumulative}")
+        return lines
+
+
+def register_collector(fn):
+    """fn() -> iterable of (name, type, help, [(labels dict, value), ...]), called per scrape."""
+    _collectors.append(fn)
+    return fn
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        try:
+            families = list(collector())
+        except Exception as e:
+            print(f"Error in metrics collector: {e}")
+            continue
+        for name, kind, help_text, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_label_text(sorted(labels.items()))} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "chatbot_stage_duration_seconds",
+    "Time spent in each stage of request handling.",
+    ["stage"],
+)
+REQUEST_SECONDS = Histogram(
+    "chatbot_http_request_duration_seconds",
+    "HTTP request latency by route (Flask streaming responses: until the first byte).",
+    ["method", "route", "status"],
+)
+FALLBACKS = Counter(
+    "chatbot_search_fallbacks_total",
+    "Searches answered by BM25 instead of vector search, by reason.",
+    ["reason"],
+)
+CHAT_ERRORS = Counter(
+    "chatbot_chat_errors_total",
+    "Chat requests that failed, by endpoint.",
+    ["endpoint"],
+)
+
+
+def span(stage):
+    """Context manager timing one stage into chatbot_stage_duration_seconds."""
+    return STAGE_SECONDS.time(stage=stage)
+
+
+_profile_lock = threading.Lock()
+
+
+@contextmanager
+def maybe_profile(name):
+    """Profile the block with probability PROFILE_SAMPLE_RATE, one block at a time."""
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        yield
+        return
+    if not _profile_lock.acquire(blocking=False):
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        try:
+            profiler.enable()
+        except ValueError:
+            yield  # another profiler (e.g. a debugger) is active
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            filename = f"{name}-{time.time_ns() // 1000}-{os.getpid()}-{threading.get_ident()}.prof"
+            path = os.path.join(PROFILE_DIR, filename)
+            profiler.dump_stats(path)
+    finally:
+        _profile_lock.release()
+
+
+def profiled(name):
+    """Decorator: run the function under maybe_profile(name)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with maybe_profile(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
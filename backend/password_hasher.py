@@ -0,0 +1,148 @@
+"""
+Password hashing off the request thread.
+
+Hashes are computed in a small process pool so a burst of logins cannot hold
+the GIL that chat requests in the same worker need. At most workers +
+max_queue hash jobs are accepted at once; past that, HasherBusy is raised so
+the endpoint can answer 503 immediately instead of queueing without bound.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Any werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+HASH_METHOD = os.getenv("HASH_METHOD", "scrypt")
+HASH_SALT_LENGTH = int(os.getenv("HASH_SALT_LENGTH", "16"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))  # 0 hashes inline on the request thread
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", "16"))
+HASH_TIMEOUT = float(os.getenv("HASH_TIMEOUT", "10"))
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue is full."""
+
+
+def _hash_job(password, method, salt_length, submitted_at):
+    started_at = time.time()
+    result = generate_password_hash(password, method=method, salt_length=salt_length)
+    return result, started_at - submitted_at, time.time() - started_at
+
+
+def _check_job(password_hash, password, submitted_at):
+    started_at = time.time()
+    result = check_password_hash(password_hash, password)
+    return result, started_at - submitted_at, time.time() - started_at
+
+
+def _percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class PasswordHasher:
+    """Bounded process pool for generate/check_password_hash."""
+
+    def __init__(self, workers=HASH_WORKERS, max_queue=HASH_MAX_QUEUE,
+                 method=HASH_METHOD, salt_length=HASH_SALT_LENGTH, timeout=HASH_TIMEOUT,
+                 observe=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.method = method
+        self.salt_length = salt_length
+        self.timeout = timeout
+        self._observe = observe  # called with (queue wait, hash time) in seconds for each finished job
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, workers) + max_queue)
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._hash_seconds = deque(maxlen=1000)
+        self._wait_seconds = deque(maxlen=1000)
+
+    def _executor(self):
+        # Started on first use, not at import, so forking happens after app setup
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _release(self, future=None):
+        self._slots.release()
+        with self._stats_lock:
+            self._in_flight -= 1
+
+    def _run(self, job, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self._rejected += 1
+            raise HasherBusy("Password hashing queue is full")
+        with self._stats_lock:
+            self._in_flight += 1
+        if self.workers > 0:
+            try:
+                future = self._executor().submit(job, *args, time.time())
+            except BaseException:
+                self._release()
+                raise
+            # The slot is freed when the job finishes or is cancelled, not when the
+            # caller gives up waiting, so timed-out jobs still count against the bound
+            future.add_done_callback(self._release)
+            try:
+                result, waited, took = future.result(timeout=self.timeout)
+            except FutureTimeout:
+                future.cancel()  # drops it if still queued; a running job frees its slot when done
+                with self._stats_lock:
+                    self._rejected += 1
+                raise HasherBusy("Password hashing timed out")
+        else:
+            try:
+                result, waited, took = job(*args, time.time())
+            finally:
+                self._release()
+        with self._stats_lock:
+            self._completed += 1
+            self._wait_seconds.append(waited)
+            self._hash_seconds.append(took)
+        if self._observe is not None:
+            self._observe(waited, took)
+        return result
+
+    def hash_password(self, password):
+        return self._run(_hash_job, password, self.method, self.salt_length)
+
+    def verify_password(self, password_hash, password):
+        return self._run(_check_job, password_hash, password)
+
+    def stats(self):
+        with self._stats_lock:
+            hash_samples = list(self._hash_seconds)
+            wait_samples = list(self._wait_seconds)
+            stats = {
+                "method": self.method,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+        stats.update({
+            "hash_ms_p50": round(_percentile(hash_samples, 0.5) * 1000, 2),
+            "hash_ms_p99": round(_percentile(hash_samples, 0.99) * 1000, 2),
+            "queue_wait_ms_p50": round(_percentile(wait_samples, 0.5) * 1000, 2),
+            "queue_wait_ms_p99": round(_percentile(wait_samples, 0.99) * 1000, 2),
+        })
+        return stats
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
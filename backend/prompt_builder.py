@@ -0,0 +1,188 @@
+"""
+Assemble the chat prompt within a token budget.
+
+PROMPT_TOKEN_BUDGET covers the whole prompt. The system prompt and the
+question are always sent; recent history gets up to HISTORY_TOKEN_BUDGET
+(newest turns first) and retrieved chunks fill what is left, up to
+CONTEXT_TOKEN_BUDGET. Budgeting uses the local estimator from chunking.py,
+so it costs no API call; the counts Gemini reports are used for accounting
+when a response carries them.
+"""
+
+import os
+import threading
+from chunking import estimate_tokens
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "400"))
+HISTORY_TURNS = 4
+MIN_CONTEXT_TOKENS = 200  # the best chunk still gets this much if the question is huge
+
+PROMPT_TEMPLATE = """{system_prompt}
+
+---
+Relevant Context from Our Website:
+{context}
+{history}
+---
+
+Customer Question: {question}
+
+Please provide a helpful, friendly response:"""
+
+
+def truncate_to_tokens(text, tokens):
+    """Cut text to about `tokens` estimated tokens, marking the cut with an ellipsis."""
+    if estimate_tokens(text) <= tokens:
+        return text
+    return text[:max(0, tokens * 4 - 1)].rstrip() + "…"
+
+
+def build_context(docs, budget=CONTEXT_TOKEN_BUDGET):
+    """Join retrieved chunks in rank order while they fit the token budget.
+
+    Returns (context, used_docs). The best chunk is always included, cut to
+    the budget if it is too long on its own.
+    """
+    parts = []
+    used = []
+    remaining = budget
+    for doc in docs:
+        heading = f"{doc['title']} - {doc['section']}" if doc.get('section') else doc['title']
+        part = f"📄 {heading}:\n{doc['content']}"
+        tokens = estimate_tokens(part)
+        if tokens > remaining:
+            if parts:
+                continue  # a shorter, lower-ranked chunk may still fit
+            part = truncate_to_tokens(part, remaining)
+            tokens = remaining
+        parts.append(part)
+        used.append(doc)
+        remaining -= tokens
+    return "\n\n".join(parts), used
+
+
+def build_history(history, budget=HISTORY_TOKEN_BUDGET, turns=HISTORY_TURNS):
+    """Format the last `turns` exchanges, newest first until the budget runs out.
+
+    Returns (text, used_turns) with used_turns in chronological order. The
+    newest exchange is kept even if it has to be shortened; older ones that
+    do not fit are dropped.
+    """
+    lines = []
+    used = []
+    remaining = budget - estimate_tokens("\n\nRecent conversation:\n")
+    for turn in reversed(history[-turns:] if turns > 0 else []):
+        line = f"Customer: {turn['question']}\nAssistant: {turn['answer']}\n"
+        tokens = estimate_tokens(line)
+        if tokens > remaining:
+            if used or remaining <= 0:
+                break
+            line = truncate_to_tokens(line.rstrip("\n"), remaining) + "\n"
+            tokens = remaining
+        lines.append(line)
+        used.append(turn)
+        remaining -= tokens
+    if not used:
+        return "", []
+    lines.reverse()
+    used.reverse()
+    return "\n\nRecent conversation:\n" + "".join(lines), used
+
+
+class Prompt:
+    """A built prompt plus the chunks and history turns it contains."""
+
+    def __init__(self, text, docs, history, tokens):
+        self.text = text
+        self.docs = docs
+        self.history = history
+        self.tokens = tokens  # estimated tokens per section and in total
+
+
+def build_prompt(system_prompt, question, docs, history, budget=PROMPT_TOKEN_BUDGET,
+                 context_budget=CONTEXT_TOKEN_BUDGET, history_budget=HISTORY_TOKEN_BUDGET):
+    """Fit history and retrieved chunks around the system prompt and question."""
+    fixed = estimate_tokens(PROMPT_TEMPLATE.format(
+        system_prompt=system_prompt, context="", history="", question=question
+    ))
+    remaining = max(0, budget - fixed)
+    history_text, used_history = build_history(history, min(history_budget, remaining))
+    remaining -= estimate_tokens(history_text)
+    context, used_docs = build_context(docs, max(MIN_CONTEXT_TOKENS, min(context_budget, remaining)))
+
+    text = PROMPT_TEMPLATE.format(
+        system_prompt=system_prompt, context=context, history=history_text, question=question
+    )
+    tokens = {
+        "system": estimate_tokens(system_prompt),
+        "context": estimate_tokens(context),
+        "history": estimate_tokens(history_text),
+        "question": estimate_tokens(question),
+        "total": estimate_tokens(text),
+    }
+    return Prompt(text, used_docs, used_history, tokens)
+
+
+def response_usage(response, prompt, answer):
+    """Token counts for one generation: Gemini's usage_metadata if present, else estimates."""
+    meta = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(meta, "prompt_token_count", 0) or 0
+    response_tokens = getattr(meta, "candidates_token_count", 0) or 0
+    if prompt_tokens:
+        return {"prompt_tokens": prompt_tokens, "response_tokens": response_tokens, "counted_by": "gemini"}
+    return {
+        "prompt_tokens": prompt.tokens["total"],
+        "response_tokens": estimate_tokens(answer),
+        "counted_by": "estimate",
+    }
+
+
+def cached_usage(answer, counted_by="cache"):
+    """Usage for an answer that cost no Gemini call of its own.
+
+    counted_by is "cache" for answer-cache hits and "shared" when the answer
+    came from an identical request that was already in flight.
+    """
+    return {"prompt_tokens": 0, "response_tokens": estimate_tokens(answer), "counted_by": counted_by}
+
+
+class TokenMeter:
+    """Running prompt/response token totals across chat requests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._cached = 0
+        self._shared = 0
+        self._prompt_tokens = 0
+        self._response_tokens = 0
+        self._max_prompt_tokens = 0
+
+    def record(self, usage):
+        with self._lock:
+            self._requests += 1
+            if usage["counted_by"] == "cache":
+                self._cached += 1
+                return
+            if usage["counted_by"] == "shared":
+                self._shared += 1
+                return
+            self._prompt_tokens += usage["prompt_tokens"]
+            self._response_tokens += usage["response_tokens"]
+            self._max_prompt_tokens = max(self._max_prompt_tokens, usage["prompt_tokens"])
+
+    def stats(self):
+        with self._lock:
+            generated = self._requests - self._cached - self._shared
+            return {
+                "requests": self._requests,
+                "cached": self._cached,
+                "shared": self._shared,
+                "prompt_tokens": self._prompt_tokens,
+                "response_tokens": self._response_tokens,
+                "avg_prompt_tokens": round(self._prompt_tokens / generated, 1) if generated else 0.0,
+                "avg_response_tokens": round(self._response_tokens / generated, 1) if generated else 0.0,
+                "max_prompt_tokens": self._max_prompt_tokens,
+            }
@@ -0,0 +1,142 @@
+"""
+Compressed in-memory codes for the embedding matrix, with exact re-ranking.
+
+The float32 matrix from embedding_store is memory-mapped, so its pages live
+in the OS cache and are shared by every worker. What each worker scans on
+every query can instead be a compact copy:
+
+    int8     1 byte per dimension    (1/4; symmetric per-row scale)
+    binary   1 bit per dimension     (1/32; sign bits, scored by Hamming distance)
+
+A query scores all codes, keeps the best top_k * rerank rows and re-scores
+only those against the float32 rows, so results keep exact similarities and
+the shortlist is the only part of the full matrix that gets read.
+Pure NumPy; codes are rebuilt from the matrix when a snapshot loads.
+"""
+
+import numpy as np
+from vector_index import normalize, top_k_from_scores, is_dense_subset
+
+# No float16: NumPy has no BLAS half-precision product, so every query would
+# convert the codes back to float32 and scan slower than the exact float32 matrix
+KINDS = ("int8", "binary")
+# Shortlist size as a multiple of top_k; sign bits are coarse and need the widest net
+DEFAULT_RERANK = {"int8": 4, "binary": 32}
+SCORE_BATCH = 1024  # rows decoded at a time; small blocks stay in cache
+
+if hasattr(np, "bitwise_count"):
+    popcount = np.bitwise_count
+else:  # NumPy < 2.0
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(words):
+        counts = _POPCOUNT_TABLE[np.ascontiguousarray(words).view(np.uint8)]
+        return counts.reshape(words.shape + (8,)).sum(axis=-1)
+
+
+def quantize_int8(vectors):
+    """Symmetric per-row int8 codes: returns (codes, scales) with vectors ~= codes * scales[:, None]."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def pack_signs(vectors):
+    """One bit per dimension (1 where the value is positive), padded to whole 64-bit words."""
+    bits = np.packbits(vectors > 0, axis=-1)
+    pad = (-bits.shape[-1]) % 8
+    if pad:
+        bits = np.pad(bits, [(0, 0)] * (bits.ndim - 1) + [(0, pad)])
+    return np.ascontiguousarray(bits).view(np.uint64)
+
+
+class QuantizedIndex:
+    """Compressed scan over the rows of a VectorIndex, re-ranked with its float32 rows."""
+
+    def __init__(self, base, kind="int8", rerank=None):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown quantization '{kind}' (expected one of {', '.join(KINDS)})")
+        self.base = base
+        self.kind = kind
+        self.rerank = rerank or DEFAULT_RERANK[kind]
+        self.scales = None
+        self.codes = np.empty((0, 0), dtype=np.int8)
+        for start in range(0, len(base), SCORE_BATCH):
+            batch = np.asarray(base.vectors[start:start + SCORE_BATCH], dtype=np.float32)
+            codes, scales = self._encode(batch)
+            if start == 0:
+                self.codes = np.empty((len(base),) + codes.shape[1:], dtype=codes.dtype)
+                self.scales = np.empty(len(base), dtype=np.float32) if scales is not None else None
+            self.codes[start:start + len(batch)] = codes
+            if scales is not None:
+                self.scales[start:start + len(batch)] = scales
+
+    def _encode(self, batch):
+        if self.kind == "int8":
+            return quantize_int8(batch)
+        return pack_signs(batch), None
+
+    def __len__(self):
+        return len(self.base)
+
+    @property
+    def nbytes(self):
+        """Memory held by the codes (the float32 matrix stays memory-mapped)."""
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def approximate_scores(self, query, rows=None):
+        """Higher-is-better score for every row (or each of `rows`) from the codes alone."""
+        n = len(self) if rows is None else len(rows)
+
+        def block_codes(start):
+            if rows is None:
+                return self.codes[start:start + SCORE_BATCH]
+            return self.codes[rows[start:start + SCORE_BATCH]]
+
+        if self.kind == "binary":
+            query_bits = pack_signs(query[None, :])[0]
+            distances = np.empty(n, dtype=np.int64)
+            for start in range(0, n, SCORE_BATCH):
+                block = block_codes(start) ^ query_bits
+                distances[start:start + len(block)] = popcount(block).sum(axis=1)
+            return -distances
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, SCORE_BATCH):
+            block = block_codes(start).astype(np.float32) @ query
+            if self.scales is not None:
+                block *= (self.scales[start:start + len(block)] if rows is None
+                          else self.scales[rows[start:start + len(block)]])
+            scores[start:start + len(block)] = block
+        return scores
+
+    def search(self, query_embedding, top_k=3, rerank=None, rows=None, excluded_rows=None):
+        """Return [(doc_index, similarity), ...]; similarities are exact float32 cosines.
+
+        rows (sorted matrix row numbers) limits the scan to a subset; with
+        its complement as excluded_rows, a large subset scans every code and
+        masks the excluded rows instead of gathering the rest.
+        """
+        allowed = len(self) if rows is None else len(rows)
+        if allowed == 0 or top_k <= 0:
+            return []
+
+        query = normalize(np.asarray(query_embedding, dtype=np.float32))
+        if rows is None or is_dense_subset(allowed, excluded_rows, len(self)):
+            candidates = np.arange(len(self))
+            scores = self.approximate_scores(query)
+            if rows is not None:
+                # Binary scores are integers; min + 1 keeps -scores from overflowing
+                lowest = -np.inf if scores.dtype.kind == "f" else np.iinfo(scores.dtype).min + 1
+                scores[excluded_rows] = lowest
+        else:
+            candidates = np.asarray(rows)
+            scores = self.approximate_scores(query, candidates)
+        shortlist = min(allowed, top_k * max(1, rerank or self.rerank))
+        if shortlist < len(candidates):
+            rows = candidates[np.argpartition(-scores, shortlist - 1)[:shortlist]]
+        else:
+            rows = candidates.copy()
+        rows.sort()  # sequential reads from a memory-mapped matrix
+        exact = self.base.vectors[rows] @ query
+        return top_k_from_scores(exact, self.base.ids[rows], top_k)
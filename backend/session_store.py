@@ -0,0 +1,157 @@
+"""
+Conversation history storage for chat sessions.
+
+MemorySessionStore keeps sessions in the worker process (LRU + TTL).
+SQLiteSessionStore keeps them in a shared SQLite database in WAL mode so
+every Gunicorn worker sees the same history.
+Both keep at most max_exchanges question/answer pairs per session.
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import threading
+from cache import LRUCache
+
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")  # memory | sqlite
+SESSION_DB = os.getenv("SESSION_DB", os.path.join(os.path.dirname(__file__), "sessions.db"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "86400"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+MAX_EXCHANGES = 10
+
+
+class MemorySessionStore:
+    """Per-process store: least recently used sessions are evicted past max_sessions."""
+
+    def __init__(self, max_sessions=SESSION_MAX, ttl=SESSION_TTL, max_exchanges=MAX_EXCHANGES):
+        self.max_exchanges = max_exchanges
+        self._sessions = LRUCache(max_entries=max_sessions, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get_history(self, session_id):
+        return list(self._sessions.get(session_id) or [])
+
+    def append(self, session_id, question, answer):
+        with self._lock:
+            history = list(self._sessions.get(session_id) or [])
+            history.append({'question': question, 'answer': answer})
+            self._sessions.set(session_id, history[-self.max_exchanges:])
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.set(session_id, [])
+
+    def stats(self):
+        stats = self._sessions.stats()
+        histories = self._sessions.values()
+        return {
+            "backend": "memory",
+            "sessions": stats["entries"],
+            "max_sessions": stats["max_entries"],
+            "ttl_seconds": stats["ttl_seconds"],
+            "exchanges": sum(len(h) for h in histories),
+            "approx_bytes": sum(
+                sys.getsizeof(h) + sum(len(x['question']) + len(x['answer']) for x in h)
+                for h in histories
+            ),
+            "evictions": stats["evictions"],
+            "expirations": stats["expirations"],
+        }
+
+
+class SQLiteSessionStore:
+    """Shared store in a WAL-mode SQLite file; one connection per thread."""
+
+    PURGE_EVERY = 200  # appends between expired-session sweeps
+
+    def __init__(self, path=SESSION_DB, ttl=SESSION_TTL, max_exchanges=MAX_EXCHANGES):
+        self.path = path
+        self.ttl = ttl
+        self.max_exchanges = max_exchanges
+        self._local = threading.local()
+        self._appends = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS session_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_session_messages_session
+                ON session_messages (session_id, id);
+            CREATE INDEX IF NOT EXISTS idx_session_messages_created
+                ON session_messages (created_at);
+        ''')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def get_history(self, session_id):
+        min_time = time.time() - self.ttl if self.ttl else 0
+        rows = self._conn().execute(
+            "SELECT question, answer FROM session_messages "
+            "WHERE session_id = ? AND created_at >= ? ORDER BY id DESC LIMIT ?",
+            (session_id, min_time, self.max_exchanges)
+        ).fetchall()
+        return [{'question': q, 'answer': a} for q, a in reversed(rows)]
+
+    def append(self, session_id, question, answer):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO session_messages (session_id, question, answer, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                (session_id, question, answer, time.time())
+            )
+            conn.execute(
+                "DELETE FROM session_messages WHERE session_id = ? AND id NOT IN ("
+                "SELECT id FROM session_messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                (session_id, session_id, self.max_exchanges)
+            )
+        self._appends += 1
+        if self.ttl and self._appends % self.PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def clear(self, session_id):
+        self._conn().execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+
+    def purge_expired(self):
+        """Delete exchanges older than the TTL; a session disappears with its last exchange."""
+        self._conn().execute(
+            "DELETE FROM session_messages WHERE created_at < ?", (time.time() - self.ttl,)
+        )
+
+    def stats(self):
+        conn = self._conn()
+        sessions, exchanges = conn.execute(
+            "SELECT COUNT(DISTINCT session_id), COUNT(*) FROM session_messages"
+        ).fetchone()
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "sessions": sessions,
+            "ttl_seconds": self.ttl,
+            "exchanges": exchanges,
+            "approx_bytes": page_count * page_size,
+        }
+
+
+def create_session_store(kind=SESSION_STORE):
+    """Build the store selected by SESSION_STORE."""
+    if kind == "sqlite":
+        return SQLiteSessionStore()
+    if kind != "memory":
+        print(f"WARNING: Unknown SESSION_STORE '{kind}', using memory")
+    return MemorySessionStore()
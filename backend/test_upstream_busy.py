@@ -0,0 +1,101 @@
+"""
+A chat request that finds Gemini saturated must answer 503 after one
+UPSTREAM_CHAT_WAIT, not wait again for each later Gemini call.
+
+    python -m unittest test_upstream_busy
+"""
+
+import os
+import json
+import time
+import asyncio
+import tempfile
+import unittest
+import numpy as np
+
+_tmp = tempfile.mkdtemp(prefix="upstream-busy-")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ.setdefault("DB_NAME", os.path.join(_tmp, "users.db"))
+os.environ["SESSION_STORE"] = "memory"
+os.environ["RELOAD_POLL_SECONDS"] = "0"
+os.environ["UPSTREAM_DB"] = os.path.join(_tmp, "upstream_limits.db")
+
+import app as chatbot
+# Warm up against the empty temp directory, not the real knowledge base
+for name in ("knowledge_base_path", "legacy_knowledge_base_path", "embeddings_path", "legacy_embeddings_path"):
+    setattr(chatbot, name, os.path.join(_tmp, os.path.basename(getattr(chatbot, name))))
+import asgi  # calls create_app()
+from fake_genai import FakeGenAI
+from vector_index import VectorIndex
+from bm25_index import BM25Index
+from index_snapshot import IndexSnapshot
+from embedding_pipeline import document_text, fake_embedding
+from upstream_limiter import UpstreamLimiter, CHAT
+
+CHAT_WAIT = 0.5
+DIM = 64
+
+
+def small_snapshot():
+    docs = [{"id": f"page{i}.html", "source": f"page{i}.html", "title": f"Page {i}",
+             "description": "", "content": f"foundation slab and roof work number {i}."}
+            for i in range(8)]
+    vectors = np.array([fake_embedding(document_text(doc), DIM) for doc in docs], dtype=np.float32)
+    return IndexSnapshot(docs, BM25Index.build(document_text(doc) for doc in docs),
+                         VectorIndex(vectors, np.arange(len(docs))))
+
+
+class UpstreamBusyTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeGenAI(dim=DIM).install(chatbot)
+        chatbot.ready.wait(60)
+        chatbot.snapshot = small_snapshot()
+
+    def setUp(self):
+        chatbot.query_embedding_cache.clear()
+        chatbot.answer_cache.clear()
+        chatbot.semantic_cache.clear()
+        # One slot, held by the test for the whole request
+        self.limiter = UpstreamLimiter(path=os.path.join(_tmp, f"{self.id()}.db"), max_concurrent=1,
+                                       chat_reserve=0, chat_wait=CHAT_WAIT)
+        chatbot.gemini_limiter = self.limiter
+        self.lease = self.limiter.acquire(CHAT)
+        self.calls = self.fake.stats()
+
+    def tearDown(self):
+        self.limiter.release(self.lease)
+
+    def assert_one_prompt_rejection(self, elapsed):
+        self.assertLess(elapsed, 2 * CHAT_WAIT)
+        self.assertEqual(self.limiter.stats()["rejected"], 1)
+        self.assertEqual(self.fake.stats(), self.calls)
+
+    def test_flask_chat(self):
+        started = time.perf_counter()
+        response = chatbot.app.test_client().post("/chat", json={"message": "how thick is a slab"})
+        elapsed = time.perf_counter() - started
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+        self.assert_one_prompt_rejection(elapsed)
+
+    def test_asgi_chat(self):
+        body = json.dumps({"message": "how thick is a slab"}).encode()
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        started = time.perf_counter()
+        asyncio.run(asgi.chat({"type": "http", "method": "POST", "path": "/chat"}, receive, send))
+        elapsed = time.perf_counter() - started
+        self.assertEqual(sent[0]["status"], 503)
+        self.assertIn(b"retry-after", dict(sent[0]["headers"]))
+        self.assert_one_prompt_rejection(elapsed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,354 @@
+"""
+Cross-process rate and concurrency limits for Gemini calls.
+
+Every worker (and ingest_data.py) shares one SQLite file in WAL mode holding
+a token bucket (requests per minute) and a table of leases (calls in
+flight). A call takes a token and a lease in one BEGIN IMMEDIATE
+transaction and gives the lease back when it finishes; leases of crashed
+processes expire or are dropped once their pid is gone.
+
+Chat calls come first: re-embedding ("batch") calls leave
+UPSTREAM_CHAT_RESERVE slots and tokens free, and wait while a chat call is queued. A chat call
+that cannot start within UPSTREAM_CHAT_WAIT raises UpstreamBusy at once
+(with a retry_after hint for a 503) instead of queueing until it times out.
+Batch calls wait as long as it takes.
+
+call() retries 429 / unavailable errors with jittered backoff; each one
+also drains the shared bucket for a moment, so every process backs off.
+"""
+
+import os
+import math
+import time
+import random
+import asyncio
+import sqlite3
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from embedding_pipeline import is_retryable
+
+CHAT = "chat"
+BATCH = "batch"
+
+UPSTREAM_DB = os.getenv("UPSTREAM_DB", os.path.join(os.path.dirname(__file__), "upstream_limits.db"))
+UPSTREAM_REQUESTS_PER_MINUTE = float(os.getenv("UPSTREAM_REQUESTS_PER_MINUTE", "600"))
+UPSTREAM_MAX_CONCURRENT = int(os.getenv("UPSTREAM_MAX_CONCURRENT", "16"))  # 0 disables the limiter
+UPSTREAM_CHAT_RESERVE = int(os.getenv("UPSTREAM_CHAT_RESERVE", "4"))
+UPSTREAM_CHAT_WAIT = float(os.getenv("UPSTREAM_CHAT_WAIT", "2"))  # seconds before answering busy
+UPSTREAM_CHAT_RETRIES = int(os.getenv("UPSTREAM_CHAT_RETRIES", "2"))
+LEASE_SECONDS = 300.0  # a lease not released by then belongs to a stuck or dead process
+POLL_SECONDS = 0.05  # longest sleep between attempts while slots are full
+THROTTLE_SECONDS = 1.0  # bucket drained for this long (doubling per retry) after a 429
+
+
+class UpstreamBusy(Exception):
+    """Raised when a Gemini call cannot start (or keeps being rate-limited) in time."""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # exists, owned by another user
+    return True
+
+
+class UpstreamLimiter:
+    """Token bucket plus concurrency semaphore shared through a SQLite file."""
+
+    def __init__(self, path=UPSTREAM_DB, requests_per_minute=UPSTREAM_REQUESTS_PER_MINUTE,
+                 max_concurrent=UPSTREAM_MAX_CONCURRENT, chat_reserve=UPSTREAM_CHAT_RESERVE,
+                 chat_wait=UPSTREAM_CHAT_WAIT, chat_retries=UPSTREAM_CHAT_RETRIES,
+                 clock=time.time, sleep=time.sleep):
+        self.path = path
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1.0, float(max_concurrent))  # burst size
+        self.max_concurrent = max_concurrent
+        self.chat_reserve = min(chat_reserve, max(0, max_concurrent - 1))
+        self.chat_wait = chat_wait
+        self.chat_retries = chat_retries
+        self.enabled = max_concurrent > 0 and self.rate > 0
+        self._clock = clock
+        self._sleep = sleep
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._acquired = {CHAT: 0, BATCH: 0}
+        self._rejected = 0
+        self._retries = 0
+        self._throttled = 0
+        self._wait_seconds = 0.0
+
+    def _conn(self):
+        # Opened per thread and per process, so forked workers never share a connection
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS bucket (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS leases (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    priority TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS chat_waiters (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    pid INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+            ''')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _refill(self, conn, now):
+        row = conn.execute("SELECT tokens, updated FROM bucket WHERE id = 1").fetchone()
+        if row is None:
+            return self.capacity
+        tokens, updated = row
+        return min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+
+    def try_acquire(self, priority=CHAT, waiter=None):
+        """One attempt: returns (lease_id, 0) or (None, seconds to wait before retrying)."""
+        now = self._clock()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+            conn.execute("DELETE FROM chat_waiters WHERE expires_at < ?", (now,))
+            tokens = self._refill(conn, now)
+            in_use = conn.execute("SELECT COUNT(*) FROM leases").fetchone()[0]
+            if in_use >= self.max_concurrent:
+                in_use -= self._drop_dead_leases(conn)
+
+            reserve = 0 if priority == CHAT else self.chat_reserve
+            chat_queued = 0
+            if priority != CHAT:
+                chat_queued = conn.execute("SELECT COUNT(*) FROM chat_waiters").fetchone()[0]
+            lease_id = None
+            if in_use >= self.max_concurrent - reserve or chat_queued:
+                wait = POLL_SECONDS
+            elif tokens < 1 + reserve:
+                wait = (1 + reserve - tokens) / self.rate
+            else:
+                tokens -= 1
+                lease_id = conn.execute(
+                    "INSERT INTO leases (priority, pid, expires_at) VALUES (?, ?, ?)",
+                    (priority, os.getpid(), now + LEASE_SECONDS)
+                ).lastrowid
+                wait = 0.0
+                if waiter is not None:
+                    conn.execute("DELETE FROM chat_waiters WHERE id = ?", (waiter,))
+            conn.execute("INSERT OR REPLACE INTO bucket (id, tokens, updated) VALUES (1, ?, ?)", (tokens, now))
+        return lease_id, wait
+
+    def _drop_dead_leases(self, conn):
+        dropped = 0
+        for (pid,) in conn.execute("SELECT DISTINCT pid FROM leases").fetchall():
+            if not _pid_alive(pid):
+                dropped += conn.execute("DELETE FROM leases WHERE pid = ?", (pid,)).rowcount
+        return dropped
+
+    def _register_waiter(self, timeout):
+        conn = self._conn()
+        with conn:
+            return conn.execute(
+                "INSERT INTO chat_waiters (pid, expires_at) VALUES (?, ?)",
+                (os.getpid(), self._clock() + timeout)
+            ).lastrowid
+
+    def _remove_waiter(self, waiter):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM chat_waiters WHERE id = ?", (waiter,))
+
+    def release(self, lease_id):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+
+    def throttle(self, seconds=THROTTLE_SECONDS):
+        """Drain the shared bucket so no process starts a call for about `seconds`."""
+        if not self.enabled:
+            return
+        now = self._clock()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            tokens = min(self._refill(conn, now), -seconds * self.rate)
+            conn.execute("INSERT OR REPLACE INTO bucket (id, tokens, updated) VALUES (1, ?, ?)", (tokens, now))
+        with self._stats_lock:
+            self._throttled += 1
+
+    def _delay(self, wait, started, timeout):
+        """Jittered sleep before the next attempt; raises UpstreamBusy once waiting would pass timeout."""
+        if timeout is not None and self._clock() - started + wait > timeout:
+            with self._stats_lock:
+                self._rejected += 1
+            raise UpstreamBusy("Gemini is busy, please try again shortly", retry_after=wait)
+        return wait * random.uniform(0.5, 1.0)
+
+    def _record(self, priority, started):
+        with self._stats_lock:
+            self._acquired[priority] += 1
+            self._wait_seconds += self._clock() - started
+
+    def acquire(self, priority=CHAT, timeout=None):
+        """Block until a token and a slot are free; returns a lease id (None when disabled).
+
+        timeout defaults to chat_wait for chat calls and to no limit for batch calls.
+        """
+        if not self.enabled:
+            return None
+        if timeout is None and priority == CHAT:
+            timeout = self.chat_wait
+        started = self._clock()
+        waiter = None
+        try:
+            while True:
+                lease_id, wait = self.try_acquire(priority, waiter)
+                if lease_id is not None:
+                    waiter = None  # removed in the same transaction
+                    self._record(priority, started)
+                    return lease_id
+                delay = self._delay(wait, started, timeout)
+                if priority == CHAT and waiter is None:
+                    waiter = self._register_waiter(timeout)
+                self._sleep(delay)
+        finally:
+            if waiter is not None:
+                self._remove_waiter(waiter)
+
+    async def acquire_async(self, priority=CHAT, timeout=None):
+        """acquire() for coroutines: SQLite work runs in a thread, waits on asyncio.sleep."""
+        if not self.enabled:
+            return None
+        if timeout is None and priority == CHAT:
+            timeout = self.chat_wait
+        started = self._clock()
+        waiter = None
+        try:
+            while True:
+                lease_id, wait = await asyncio.to_thread(self.try_acquire, priority, waiter)
+                if lease_id is not None:
+                    waiter = None
+                    self._record(priority, started)
+                    return lease_id
+                delay = self._delay(wait, started, timeout)
+                if priority == CHAT and waiter is None:
+                    waiter = await asyncio.to_thread(self._register_waiter, timeout)
+                await asyncio.sleep(delay)
+        finally:
+            if waiter is not None:
+                await asyncio.to_thread(self._remove_waiter, waiter)
+
+    @contextmanager
+    def slot(self, priority=CHAT, timeout=None):
+        """Hold a token and a slot for the duration of the block; a 429 inside throttles everyone."""
+        lease_id = self.acquire(priority, timeout)
+        try:
+            yield
+        except Exception as e:
+            if is_retryable(e):
+                self.throttle()
+            raise
+        finally:
+            if lease_id is not None:
+                self.release(lease_id)
+
+    @asynccontextmanager
+    async def slot_async(self, priority=CHAT, timeout=None):
+        lease_id = await self.acquire_async(priority, timeout)
+        try:
+            yield
+        except Exception as e:
+            if is_retryable(e):
+                await asyncio.to_thread(self.throttle)
+            raise
+        finally:
+            if lease_id is not None:
+                await asyncio.to_thread(self.release, lease_id)
+
+    def _backoff(self, attempt, error):
+        if attempt == self.chat_retries:
+            with self._stats_lock:
+                self._rejected += 1
+            raise UpstreamBusy("Gemini is rate limiting requests, please try again shortly",
+                               retry_after=THROTTLE_SECONDS * 2 ** attempt) from error
+        with self._stats_lock:
+            self._retries += 1
+        delay = THROTTLE_SECONDS * 2 ** attempt
+        return random.uniform(delay / 2, delay)
+
+    def call(self, fn, priority=CHAT):
+        """Run fn() in a slot, retrying retryable errors with jittered backoff.
+
+        Raises UpstreamBusy when no slot frees up in time or Gemini keeps answering 429.
+        """
+        for attempt in range(self.chat_retries + 1):
+            try:
+                with self.slot(priority):
+                    return fn()
+            except UpstreamBusy:
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                self._sleep(self._backoff(attempt, e))
+
+    async def call_async(self, coro_fn, priority=CHAT):
+        """call() for coroutine functions."""
+        for attempt in range(self.chat_retries + 1):
+            try:
+                async with self.slot_async(priority):
+                    return await coro_fn()
+            except UpstreamBusy:
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e))
+
+    def stats(self):
+        """This process's counters plus the shared in-flight count."""
+        with self._stats_lock:
+            acquired = dict(self._acquired)
+            stats = {
+                "enabled": self.enabled,
+                "requests_per_minute": round(self.rate * 60, 1),
+                "max_concurrent": self.max_concurrent,
+                "chat_reserve": self.chat_reserve,
+                "acquired": acquired,
+                "rejected": self._rejected,
+                "retries": self._retries,
+                "throttled": self._throttled,
+                "avg_wait_ms": round(self._wait_seconds / max(1, sum(acquired.values())) * 1000, 2),
+            }
+        stats["in_flight"] = {CHAT: 0, BATCH: 0}
+        if self.enabled and os.path.exists(self.path):  # a stats read does not create the file
+            try:
+                rows = self._conn().execute(
+                    "SELECT priority, COUNT(*) FROM leases WHERE expires_at >= ? GROUP BY priority",
+                    (self._clock(),)
+                ).fetchall()
+                stats["in_flight"].update(dict(rows))
+            except sqlite3.Error as e:
+                stats["error"] = str(e)
+        return stats
@@ -0,0 +1,79 @@
+"""
+In-memory vector index for semantic search.
+Holds all document embeddings as one pre-normalized float32 matrix.
+"""
+
+import numpy as np
+
+# A subset at least this large a fraction of the rows is scored with the full
+# matrix-vector product and the other rows masked; gathering it would copy most of the matrix
+DENSE_SUBSET = 0.5
+
+
+class VectorIndex:
+    """Exact cosine-similarity index over a dense embedding matrix.
+
+    Pass normalized=True for rows that are already unit length (e.g. a
+    memory-mapped matrix from embedding_store) to use them without a copy.
+    """
+
+    def __init__(self, vectors, ids, normalized=False):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.vectors = vectors if normalized else normalize(vectors)
+        self.ids = np.asarray(ids, dtype=np.int64)
+
+    @classmethod
+    def empty(cls, dim=0):
+        return cls(np.zeros((0, dim), dtype=np.float32), [])
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def search(self, query_embedding, top_k=3, rows=None, excluded_rows=None):
+        """Return [(doc_index, similarity), ...] for the top_k closest documents.
+
+        rows (sorted matrix row numbers) limits the scan to a subset;
+        excluded_rows, its complement, lets a large subset be scored as one
+        full product with the excluded rows masked out.
+        """
+        n = len(self) if rows is None else len(rows)
+        if n == 0 or top_k <= 0:
+            return []
+
+        query = normalize(np.asarray(query_embedding, dtype=np.float32))
+        if rows is None:
+            return top_k_from_scores(self.vectors @ query, self.ids, top_k)
+        if is_dense_subset(n, excluded_rows, len(self)):
+            scores = self.vectors @ query
+            scores[excluded_rows] = -np.inf
+            return top_k_from_scores(scores, self.ids, min(top_k, n))
+        return top_k_from_scores(self.vectors[rows] @ query, self.ids[rows], top_k)
+
+
+def is_dense_subset(subset_size, excluded_rows, total):
+    """True when a subset is better scored over all rows with excluded_rows masked."""
+    return excluded_rows is not None and subset_size >= total * DENSE_SUBSET
+
+
+def normalize(vectors):
+    """L2-normalize a vector or each row of a matrix (zero rows stay zero)."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_from_scores(scores, ids, top_k):
+    """Select the top_k scores with argpartition and return them sorted."""
+    top_k = min(top_k, scores.shape[0])
+    if top_k == 0:
+        return []
+    if top_k < scores.shape[0]:
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    order = candidates[np.argsort(-scores[candidates], kind='stable')]
+    return [(int(ids[i]), float(scores[i])) for i in order]